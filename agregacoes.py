@@ -0,0 +1,267 @@
+import numpy as np
+import pandas as pd
+
+from metricas import calcular_metrica
+
+# Métricas disponíveis em cada aba de "Análise de Desempenho"
+METRICAS_TOP_PRODUTOS = ["Faturamento do Produto", "Unidades Compradas"]
+METRICAS_TOP_CIDADES = ["Faturamento Total da Cidade no Mês", "Unidades Compradas", "Pedidos com Produto"]
+METRICAS_TOP_ESTADOS = ["Faturamento Total da Cidade no Mês", "Unidades Compradas", "Pedidos com Produto"]
+
+# Chaves de uma série temporal Produto × Cidade (o estado acompanha a cidade)
+CHAVES_SERIE = ['Produto', 'Estado', 'Cidade']
+
+# Maior valor permitido nos sliders de Top N; os rankings são cacheados com esse tamanho
+TOP_N_MAXIMO = 20
+
+# As funções abaixo aceitam um DataFrame ou um iterável de blocos (DataFrames).
+# Cada bloco precisa conter meses completos: os totais da cidade ('first' por Mês/Cidade)
+# só podem ser somados entre blocos se nenhum mês estiver dividido em dois blocos.
+
+
+def _blocos(dados):
+    return [dados] if isinstance(dados, pd.DataFrame) else dados
+
+
+def _somar_series(acumulado, parcial):
+    if acumulado is None:
+        return parcial
+    return acumulado.add(parcial, fill_value=0)
+
+
+def assinatura_filtros(meses=(), estados=(), cidades=(), produtos=()):
+    """
+    Gera uma assinatura canônica (hashable) para uma combinação de filtros globais.
+    Uma tupla vazia significa "sem filtro" naquela dimensão.
+    """
+    meses_str = tuple(sorted(pd.Timestamp(m).strftime('%Y-%m') for m in meses))
+    return (
+        meses_str,
+        tuple(sorted(estados)),
+        tuple(sorted(cidades)),
+        tuple(sorted(produtos)),
+    )
+
+
+def aplicar_filtros(df, assinatura):
+    """
+    Aplica ao DataFrame os filtros descritos por uma assinatura gerada em `assinatura_filtros`.
+    """
+    meses, estados, cidades, produtos = assinatura
+    mask = pd.Series(True, index=df.index)
+
+    if meses:
+        mask &= df['Mês'].isin(pd.to_datetime(list(meses), format='%Y-%m'))
+    if estados:
+        mask &= df['Estado'].isin(estados)
+    if cidades:
+        mask &= df['Cidade'].isin(cidades)
+    if produtos:
+        mask &= df['Produto'].isin(produtos)
+
+    return df[mask]
+
+
+def blocos_filtrados(dados, assinatura, colunas=None):
+    """
+    Blocos filtrados pela assinatura: o próprio DataFrame filtrado (em memória) ou,
+    no modo out-of-core, um bloco por mês lido do armazenamento em disco.
+    """
+    if isinstance(dados, pd.DataFrame):
+        filtrado = aplicar_filtros(dados, assinatura)
+        return [filtrado if colunas is None else filtrado[colunas]]
+    return dados.iterar(assinatura, colunas=colunas)
+
+
+def _parciais_kpis(bloco, com_produtos):
+    if com_produtos:
+        faturamento = bloco['Faturamento do Produto'].sum()
+        pedidos = bloco['Pedidos com Produto'].sum()
+    else:
+        base = bloco.groupby(['Mês', 'Cidade']).agg(
+            total_pedidos_cidade_mes=('Total de Pedidos da Cidade no Mês', 'first'),
+            faturamento_total_cidade_mes=('Faturamento Total da Cidade no Mês', 'first')
+        )
+        faturamento = base['faturamento_total_cidade_mes'].sum()
+        pedidos = base['total_pedidos_cidade_mes'].sum()
+
+    # O KPI "% Partic. Faturamento Prod. (Méd.)" é intencionalmente a média das participações linha a linha
+    # (participação típica de um produto na cidade), e não a razão das somas: nesta, o faturamento da cidade
+    # seria somado uma vez por produto. Por isso acumula soma e contagem das razões, e não numerador e denominador.
+    participacao = calcular_metrica('Participação Faturamento Cidade Mês (%)', bloco)
+    return {
+        'total_faturamento': faturamento,
+        'total_pedidos': pedidos,
+        'total_unidades_fisicas': bloco['Unidades Compradas'].sum(),
+        'soma_participacao': participacao.sum(),
+        'n_participacao': participacao.count(),
+    }
+
+
+def _finalizar_kpis(totais):
+    total_faturamento = totais['total_faturamento']
+    total_pedidos = totais['total_pedidos']
+    return {
+        'total_faturamento': total_faturamento,
+        'total_pedidos': total_pedidos,
+        'total_unidades_fisicas': totais['total_unidades_fisicas'],
+        # Ticket médio recalculado sobre os totais (razão das somas)
+        'ticket_medio_geral': calcular_metrica(
+            'Ticket Médio do Produto', totais,
+            colunas={'Faturamento do Produto': 'total_faturamento', 'Pedidos com Produto': 'total_pedidos'}
+        ),
+        'media_participacao_faturamento': (
+            totais['soma_participacao'] / totais['n_participacao'] if totais['n_participacao'] > 0 else float('nan')
+        ),
+    }
+
+
+def _serie_top(bloco, dimensao, metrica, com_produtos):
+    """
+    Totais por item de uma dimensão ('Produto', 'Cidade' ou 'Estado') em um bloco.
+    """
+    if metrica == "Faturamento Total da Cidade no Mês":
+        if com_produtos:
+            # Com produtos selecionados, o faturamento considerado é o dos produtos
+            return bloco.groupby(dimensao)['Faturamento do Produto'].sum()
+        if dimensao == 'Cidade':
+            return bloco.groupby(['Mês', 'Cidade'])[metrica].first().groupby('Cidade').sum()
+        return bloco.groupby(['Mês', dimensao])[metrica].sum().groupby(dimensao).sum()
+    return bloco.groupby(dimensao)[metrica].sum()
+
+
+def _finalizar_top(serie, dimensao, n):
+    top = serie.astype(float).nlargest(n).reset_index()
+    top.columns = [dimensao, 'Total']
+    return top
+
+
+def _rankings(dimensoes=None):
+    for dimensao, metricas in (
+        ('Produto', METRICAS_TOP_PRODUTOS),
+        ('Cidade', METRICAS_TOP_CIDADES),
+        ('Estado', METRICAS_TOP_ESTADOS),
+    ):
+        if dimensoes is not None and dimensao not in dimensoes:
+            continue
+        for metrica in metricas:
+            yield dimensao, metrica
+
+
+def calcular_agregados(dados, assinatura, dimensoes=None):
+    """
+    Calcula KPIs e rankings da primeira página para uma assinatura de filtros, em uma única passada.
+    `dados` é o DataFrame completo ou o armazenamento mensal do modo out-of-core.
+    `dimensoes` restringe os rankings calculados (ex.: ('Estado',) quando os demais vêm dos sketches).
+    """
+    blocos = blocos_filtrados(dados, assinatura)
+    com_produtos = bool(assinatura[3])
+
+    vazio = True
+    totais = None
+    series = {}
+    for bloco in blocos:
+        if bloco.empty:
+            continue
+        vazio = False
+        parciais = _parciais_kpis(bloco, com_produtos)
+        totais = parciais if totais is None else {k: totais[k] + v for k, v in parciais.items()}
+        for chave in _rankings(dimensoes):
+            series[chave] = _somar_series(series.get(chave), _serie_top(bloco, *chave, com_produtos))
+
+    if vazio:
+        return {'vazio': True, 'kpis': None, 'tops': {}}
+    return {
+        'vazio': False,
+        'kpis': _finalizar_kpis(totais),
+        'tops': {chave: _finalizar_top(serie, chave[0], TOP_N_MAXIMO) for chave, serie in series.items()},
+    }
+
+
+def totais_periodo(dados, com_produtos):
+    """
+    Faturamento, pedidos e número de meses distintos de um período, usados nos comparativos.
+    Com produtos selecionados usa as métricas do produto; caso contrário, os totais da cidade.
+    """
+    faturamento = 0
+    pedidos = 0
+    meses = set()
+    for bloco in _blocos(dados):
+        if com_produtos:
+            faturamento += bloco['Faturamento do Produto'].sum()
+            pedidos += bloco['Pedidos com Produto'].sum()
+        else:
+            faturamento += bloco.groupby(['Mês', 'Cidade'])['Faturamento Total da Cidade no Mês'].first().sum()
+            pedidos += bloco.groupby(['Mês', 'Cidade'])['Total de Pedidos da Cidade no Mês'].first().sum()
+        meses.update(bloco['Mês'].dt.to_period('M').unique())
+    return faturamento, pedidos, len(meses)
+
+
+def produtos_presentes(dados, assinatura):
+    """
+    Conjunto de produtos com dados para a assinatura.
+    """
+    produtos = set()
+    for bloco in blocos_filtrados(dados, assinatura, colunas=['Produto']):
+        produtos.update(bloco['Produto'].unique())
+    return produtos
+
+
+def evolucao_produtos(dados, assinatura):
+    """
+    Faturamento e unidades por Mês e Produto, com média móvel de 3 meses.
+    """
+    partes = [
+        bloco.groupby(['Mês', 'Produto']).agg(
+            faturamento=('Faturamento do Produto', 'sum'),
+            unidades_compradas=('Unidades Compradas', 'sum')
+        ).reset_index()
+        for bloco in blocos_filtrados(dados, assinatura, colunas=['Mês', 'Produto', 'Faturamento do Produto', 'Unidades Compradas'])
+    ]
+    if not partes:
+        return pd.DataFrame(columns=['Mês', 'Produto', 'faturamento', 'unidades_compradas', 'faturamento_mm3', 'unidades_mm3'])
+    df_produtos_tempo = pd.concat(partes, ignore_index=True).sort_values(['Mês', 'Produto'], ignore_index=True)
+    # Adiciona colunas com média móvel de 3 meses
+    df_produtos_tempo['faturamento_mm3'] = df_produtos_tempo.groupby('Produto')['faturamento'].transform(lambda x: x.rolling(3, min_periods=1).mean())
+    df_produtos_tempo['unidades_mm3'] = df_produtos_tempo.groupby('Produto')['unidades_compradas'].transform(lambda x: x.rolling(3, min_periods=1).mean())
+    return df_produtos_tempo
+
+
+def matrizes_series(dados):
+    """
+    Matrizes densas (séries Produto × Cidade × meses) de faturamento, unidades e faturamento total
+    da cidade, com zero nos meses sem venda da série.
+    Retorna (MultiIndex das séries, meses, {coluna: matriz}).
+    As matrizes ocupam memória proporcional a séries × meses, da ordem do próprio histórico:
+    por isso previsões e anomalias (que as usam) ficam desativadas no modo out-of-core.
+    """
+    colunas_soma = ['Faturamento do Produto', 'Unidades Compradas']
+    coluna_cidade = 'Faturamento Total da Cidade no Mês'
+    partes = []
+    for bloco in blocos_filtrados(dados, assinatura_filtros(), colunas=['Mês'] + CHAVES_SERIE + colunas_soma + [coluna_cidade]):
+        valores = bloco[colunas_soma + [coluna_cidade]].apply(pd.to_numeric, errors='coerce')
+        chaves = [bloco[c] for c in ['Mês'] + CHAVES_SERIE]
+        # O total da cidade se repete em todas as linhas da cidade no mês
+        partes.append(pd.concat([
+            valores[colunas_soma].groupby(chaves).sum(),
+            valores[coluna_cidade].groupby(chaves).first(),
+        ], axis=1))
+
+    # Cada bloco tem meses completos, então as chaves (Mês, série) não se repetem entre blocos
+    agregado = pd.concat(partes) if partes else None
+    if agregado is None or agregado.empty:
+        return pd.MultiIndex.from_tuples([], names=CHAVES_SERIE), pd.DatetimeIndex([]), {}
+    meses_agregado = agregado.index.get_level_values('Mês')
+    meses = pd.date_range(meses_agregado.min(), meses_agregado.max(), freq='MS')
+    codigos_series, series = pd.MultiIndex.from_arrays(
+        [agregado.index.get_level_values(c) for c in CHAVES_SERIE]
+    ).factorize()
+    series = pd.MultiIndex.from_tuples(series, names=CHAVES_SERIE)
+    codigos_meses = meses.get_indexer(meses_agregado)
+
+    matrizes = {}
+    for coluna in colunas_soma + [coluna_cidade]:
+        matriz = np.zeros((len(series), len(meses)))
+        matriz[codigos_series, codigos_meses] = agregado[coluna].fillna(0).to_numpy(dtype=float)
+        matrizes[coluna] = matriz
+    return series, meses, matrizes
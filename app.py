@@ -5,8 +5,23 @@ import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import numpy as np
 import io
-# Assegure-se de que 'column_mapping.py' esteja na mesma pasta
-from column_mapping import column_mapping
+import hashlib
+import os
+import tempfile
+import time
+from agregacoes import (
+    assinatura_filtros, aplicar_filtros, blocos_filtrados, calcular_agregados,
+    evolucao_produtos, produtos_presentes, totais_periodo
+)
+from cache_warmer import CacheWarmer, assinaturas_quentes
+from export_excel import calcular_resumo, gerar_csv, gerar_excel
+from sketches import SketchesMensais
+from busca_produtos import IndiceProdutos
+from carregamento import ErroCarregamento, carregar_fontes, iterar_fontes, preprocessar_dados, url_aba_google_sheets
+from out_of_core import ArmazenamentoMensal
+from previsao import anexar_previsao, calcular_previsoes, previsao_produtos
+from metricas import adicionar_metricas
+from insights import JANELA_BASE, LIMIAR_Z, detectar_anomalias, filtrar_anomalias
 
 # Helper function for Brazilian currency formatting (dot for thousands, comma for decimals)
 def format_currency_br(value):
@@ -29,6 +44,11 @@ def format_integer_br(value):
     s_value = s_value.replace(",", "X").replace(".", ",").replace("X", ".")
     return s_value
 
+# Legenda exibida abaixo dos rankings calculados no modo aproximado
+def legenda_modo_aproximado(metrica, erro):
+    erro_formatado = format_currency_br(erro) if 'Faturamento' in metrica else format_integer_br(erro)
+    return f"⚡ Modo aproximado: cada total pode estar subestimado em até {erro_formatado}. Desative o modo aproximado para valores exatos."
+
 # Configuração da página
 st.set_page_config(
     page_title="Dashboard TopCity", 
@@ -138,72 +158,180 @@ st.markdown("""
 # Título Principal do Dashboard
 st.markdown("<h1 class='main-header'>Dashboard de Análise de Produtos e Cidades 🏙️</h1>", unsafe_allow_html=True)
 
-@st.cache_data
-def load_data():
+def fontes_configuradas():
     """
-    Carrega e pré-processa os dados da planilha do Google Sheets.
+    Abas da planilha (ex.: uma por ano ou região) e fontes extras configuradas nos secrets.
     """
     # **IMPORTANTE**: Certifique-se que esta URL e o nome da aba estão corretos e a planilha é pública para leitura.
     sheet_id = st.secrets["sheet_id"]
-    tab_name = 'Produtos_Cidades_Completas'
-    google_sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={tab_name}"
+    tab_names = list(st.secrets.get("sheet_tabs", ['Produtos_Cidades_Completas']))
+    fontes = [url_aba_google_sheets(sheet_id, tab_name) for tab_name in tab_names]
+    # Fontes adicionais opcionais: URLs de CSV ou caminhos locais com o mesmo schema
+    fontes += list(st.secrets.get("data_sources", []))
+    return fontes
+
+def erro_carregamento(e):
+    st.error(f"Erro ao carregar dados da planilha do Google Sheets: {e}")
+    st.warning("Por favor, verifique se o ID da planilha e o nome da aba estão corretos e se a planilha está compartilhada como 'Qualquer pessoa com o link'.")
+    st.stop()
+
+def planilha_vazia():
+    st.warning("A planilha do Google Sheets está vazia ou não contém dados. Verifique a planilha ou os filtros iniciais.")
+    st.stop()
 
+@st.cache_data
+def load_data():
+    """
+    Carrega e pré-processa os dados da planilha do Google Sheets.
+    As abas e fontes extras são baixadas em paralelo e concatenadas.
+    """
     with st.spinner("Carregando dados... Por favor, aguarde."):
         try:
-            df = pd.read_csv(google_sheet_url)
-        except Exception as e:
-            st.error(f"Erro ao carregar dados da planilha do Google Sheets: {e}")
-            st.warning("Por favor, verifique se o ID da planilha e o nome da aba estão corretos e se a planilha está compartilhada como 'Qualquer pessoa com o link'.")
-            st.stop()
+            df = carregar_fontes(fontes_configuradas())
+        except ErroCarregamento as e:
+            erro_carregamento(e)
 
     if df.empty:
-        st.warning("A planilha do Google Sheets está vazia ou não contém dados. Verifique a planilha ou os filtros iniciais.")
-        st.stop()
+        planilha_vazia()
 
-    # Convert 'mes' to datetime objects
-    df['mes'] = pd.to_datetime(df['mes'], format='%Y-%m')
+    df = preprocessar_dados(df)
 
-    # Conversão robusta de colunas numéricas:
-    df.loc[:, 'faturamento'] = pd.to_numeric(df['faturamento'].astype(str).str.replace(',', '.', regex=False), errors='coerce').fillna(0)
-    df.loc[:, 'faturamento_total_cidade_mes'] = pd.to_numeric(df['faturamento_total_cidade_mes'].astype(str).str.replace(',', '.', regex=False), errors='coerce').fillna(0)
+    # Versão dos dados: identifica esta carga nas chaves de cache das agregações
+    df.attrs['versao_dados'] = hashlib.sha1(
+        pd.util.hash_pandas_object(df, index=False).values.tobytes()
+    ).hexdigest()[:16]
+    
+    return df
 
-    df.loc[:, 'unidades_fisicas'] = pd.to_numeric(df['unidades_fisicas'], errors='coerce').fillna(0)
-    df.loc[:, 'pedidos'] = pd.to_numeric(df['pedidos'], errors='coerce').fillna(0)
-    df.loc[:, 'total_pedidos_cidade_mes'] = pd.to_numeric(df['total_pedidos_cidade_mes'], errors='coerce').fillna(0)
+@st.cache_resource(show_spinner=False)
+def load_data_out_of_core(diretorio):
+    """
+    Modo out-of-core: cada aba/fonte é pré-processada e gravada em disco, particionada por mês,
+    assim que termina de carregar. O histórico completo nunca fica inteiro em memória.
+    """
+    armazenamento = ArmazenamentoMensal(diretorio)
+    armazenamento.limpar()
+    with st.spinner("Carregando dados... Por favor, aguarde."):
+        try:
+            for _, parte in iterar_fontes(fontes_configuradas()):
+                if not parte.empty:
+                    armazenamento.gravar(preprocessar_dados(parte))
+        except ErroCarregamento as e:
+            erro_carregamento(e)
 
-    # Renomear colunas para nomes amigáveis usando o mapping importado
-    df = df.rename(columns=column_mapping)
+    if not armazenamento.meses:
+        planilha_vazia()
 
-    # CORREÇÃO: Calcular Métricas Derivadas com tratamento robusto de divisão por zero
-    
-    # 1. Participação Faturamento Cidade Mês (%)
-    # Cria uma máscara para valores não zero no denominador
-    mask_fat = df['Faturamento Total da Cidade no Mês'] != 0
-    df.loc[:, 'Participação Faturamento Cidade Mês (%)'] = 0.0  # Inicializa com zero
-    df.loc[mask_fat, 'Participação Faturamento Cidade Mês (%)'] = (
-        df.loc[mask_fat, 'Faturamento do Produto'] / 
-        df.loc[mask_fat, 'Faturamento Total da Cidade no Mês']
-    ) * 100
-
-    # 2. Participação Pedidos Cidade Mês (%)
-    mask_ped = df['Total de Pedidos da Cidade no Mês'] != 0
-    df.loc[:, 'Participação Pedidos Cidade Mês (%)'] = 0.0  # Inicializa com zero
-    df.loc[mask_ped, 'Participação Pedidos Cidade Mês (%)'] = (
-        df.loc[mask_ped, 'Pedidos com Produto'] / 
-        df.loc[mask_ped, 'Total de Pedidos da Cidade no Mês']
-    ) * 100
-
-    # 3. Ticket Médio do Produto
-    mask_ticket = df['Pedidos com Produto'] != 0
-    df.loc[:, 'Ticket Médio do Produto'] = 0.0  # Inicializa com zero
-    df.loc[mask_ticket, 'Ticket Médio do Produto'] = (
-        df.loc[mask_ticket, 'Faturamento do Produto'] / 
-        df.loc[mask_ticket, 'Pedidos com Produto']
-    )
-    
-    return df
+    armazenamento.finalizar()
+    return armazenamento
+
+@st.cache_data(show_spinner=False)
+def agregados_dashboard(_dados, versao_dados, assinatura, dimensoes=None):
+    """
+    KPIs e rankings Top N para uma assinatura de filtros, cacheados por versão dos dados.
+    """
+    return calcular_agregados(_dados, assinatura, dimensoes)
+
+@st.cache_data(show_spinner=False)
+def comparativo_dashboard(_dados, versao_dados, assinatura_periodo):
+    """
+    Faturamento, pedidos e número de meses de um período dos comparativos.
+    """
+    if not assinatura_periodo[0]:
+        # Nenhum mês disponível no período
+        return 0, 0, 0
+    return totais_periodo(blocos_filtrados(_dados, assinatura_periodo), bool(assinatura_periodo[3]))
+
+@st.cache_data(show_spinner=False)
+def produtos_presentes_dashboard(_dados, versao_dados, assinatura):
+    """
+    Produtos com dados para a assinatura, usados nas opções do gráfico de evolução.
+    """
+    return produtos_presentes(_dados, assinatura)
+
+@st.cache_data(show_spinner=False)
+def evolucao_produtos_dashboard(_dados, versao_dados, assinatura):
+    """
+    Faturamento e unidades por Mês e Produto da assinatura, com média móvel de 3 meses.
+    """
+    return evolucao_produtos(_dados, assinatura)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def tabela_detalhada_dashboard(_df_filtrado, versao_dados, assinatura, coluna, ascending):
+    """
+    Dados filtrados com as métricas derivadas, ordenados por `coluna`.
+    Cada entrada tem o tamanho dos dados filtrados, por isso o cache guarda poucas entradas.
+    """
+    return adicionar_metricas(_df_filtrado).sort_values(by=coluna, ascending=ascending)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def tabela_detalhada_out_of_core(_dados, versao_dados, assinatura, coluna, ascending):
+    """
+    As 1.000 primeiras linhas da tabela detalhada na ordenação escolhida, com as métricas derivadas.
+    """
+    return _dados.maiores_linhas(assinatura, coluna, ascending=ascending, n=1000)
+
+@st.cache_data(show_spinner=False)
+def previsoes_dashboard(_dados, versao_dados):
+    """
+    Previsão do próximo mês para todas as séries Produto × Cidade, ajustada uma vez por versão dos dados.
+    """
+    return calcular_previsoes(_dados)
 
-df = load_data()
+@st.cache_data(show_spinner=False)
+def anomalias_dashboard(_dados, versao_dados):
+    """
+    Anomalias de todas as séries Produto × Cidade × Mês, detectadas uma vez por versão dos dados.
+    """
+    return detectar_anomalias(_dados)
+
+@st.cache_data(show_spinner=False)
+def insights_dashboard(_dados, versao_dados, assinatura, n):
+    """
+    As `n` maiores anomalias dentro de uma assinatura de filtros.
+    """
+    return filtrar_anomalias(anomalias_dashboard(_dados, versao_dados), assinatura, n)
+
+@st.cache_resource(show_spinner=False)
+def sketches_dashboard(_df, versao_dados):
+    """
+    Sketches mensais (HyperLogLog e Top-K) e listas de opções dos filtros, construídos uma vez por versão dos dados.
+    """
+    return SketchesMensais(_df)
+
+@st.cache_resource(show_spinner=False)
+def indice_produtos_dashboard(_dados, versao_dados):
+    """
+    Índice de busca por nome de produto e SKU, construído uma vez por versão dos dados.
+    """
+    if isinstance(_dados, pd.DataFrame):
+        return IndiceProdutos(_dados)
+    return IndiceProdutos(_dados.catalogo_produtos())
+
+@st.cache_data(show_spinner=False)
+def opcoes_filtros_out_of_core(_dados, versao_dados):
+    return _dados.opcoes_filtros()
+
+@st.cache_resource
+def obter_cache_warmer():
+    return CacheWarmer(max_workers=int(st.secrets.get("cache_warmer_workers", 2)))
+
+# Modo out-of-core: definido pelo secret "out_of_core_dir" (diretório para as partições mensais em disco)
+modo_out_of_core = bool(st.secrets.get("out_of_core_dir"))
+
+if modo_out_of_core:
+    # `dados` é o armazenamento em disco; as consultas leem um mês por vez
+    dados = load_data_out_of_core(st.secrets["out_of_core_dir"])
+    versao_dados = dados.versao_dados
+    # Os sketches dependem do DataFrame completo: o modo aproximado fica indisponível
+    sketches = None
+    opcoes_filtros = opcoes_filtros_out_of_core(dados, versao_dados)
+else:
+    dados = load_data()
+    versao_dados = dados.attrs['versao_dados']
+    sketches = sketches_dashboard(dados, versao_dados)
+    opcoes_filtros = sketches.opcoes_filtros()
+indice_produtos = indice_produtos_dashboard(dados, versao_dados)
 
 # --- Sidebar para Filtros ---
 st.sidebar.header("⚙️ Filtros Globais")
@@ -214,22 +342,48 @@ if st.sidebar.button("🔄 Resetar Filtros"):
     st.session_state['selected_estados'] = []
     st.session_state['selected_cidades'] = []
     st.session_state['selected_produtos'] = []
+    # O multiselect de produtos lê a seleção do próprio widget; limpa também a busca
+    st.session_state.pop('produto_filter', None)
+    st.session_state['produto_busca'] = ''
     # Recarrega a página para aplicar o reset
     st.experimental_rerun()
 
 # Recupera valores padrão ou do session_state
-min_date = df['Mês'].min()
-max_date = df['Mês'].max()
-
-available_months = sorted(df['Mês'].dt.to_period('M').unique().to_timestamp().tolist())
+available_months = list(opcoes_filtros['meses'])
+min_date = available_months[0]
+max_date = available_months[-1]
+
+# Aquece em segundo plano, após cada carga, o que é calculado ao abrir o dashboard:
+# KPIs e rankings das combinações de filtros mais comuns, a tabela detalhada da seleção padrão na
+# ordenação padrão (o cache dela guarda poucas entradas) e, em memória, previsões e anomalias do catálogo.
+# Os exports são gerados só quando pedidos e não são aquecidos.
+# A chave do st.cache_data é montada só com os argumentos passados (os valores padrão não entram):
+# as chamadas abaixo devem ter exatamente a mesma forma das chamadas da página, ou o cache aquecido não é usado.
+def aquecer_assinatura(assinatura):
+    agregados_dashboard(dados, versao_dados, assinatura, None)
+    if assinatura == assinatura_filtros():
+        if modo_out_of_core:
+            tabela_detalhada_out_of_core(dados, versao_dados, assinatura, 'Faturamento do Produto', False)
+        else:
+            tabela_detalhada_dashboard(dados, versao_dados, assinatura, 'Faturamento do Produto', False)
+
+obter_cache_warmer().agendar(
+    versao_dados,
+    assinaturas_quentes(available_months, opcoes_filtros['estados'], int(st.secrets.get("cache_warmer_ultimos_meses", 3))),
+    aquecer_assinatura,
+    () if modo_out_of_core else (
+        lambda: previsoes_dashboard(dados, versao_dados),
+        lambda: anomalias_dashboard(dados, versao_dados),
+    )
+)
 
 # Usa session_state para manter o estado dos filtros após o reset
 if 'selected_months' not in st.session_state:
     st.session_state['selected_months'] = available_months
 if 'selected_estados' not in st.session_state:
-    st.session_state['selected_estados'] = sorted(df['Estado'].unique())
+    st.session_state['selected_estados'] = opcoes_filtros['estados']
 if 'selected_cidades' not in st.session_state:
-    st.session_state['selected_cidades'] = sorted(df['Cidade'].unique())
+    st.session_state['selected_cidades'] = opcoes_filtros['cidades']
 if 'selected_produtos' not in st.session_state:
     st.session_state['selected_produtos'] = []
 
@@ -244,7 +398,7 @@ selected_months = st.sidebar.multiselect(
 
 
 # Filtro de Estado
-all_estados = sorted(df['Estado'].unique())
+all_estados = opcoes_filtros['estados']
 selected_estados = st.sidebar.multiselect(
     "Selecione o(s) Estado(s)",
     options=all_estados,
@@ -254,11 +408,12 @@ selected_estados = st.sidebar.multiselect(
 
 # Filtro de Cidade (dependente do estado)
 if selected_estados:
-    available_cidades = sorted(df[df['Estado'].isin(selected_estados)]['Cidade'].unique())
+    available_cidades = sorted(set().union(*(opcoes_filtros['cidades_por_estado'].get(e, []) for e in selected_estados)))
 else:
-    available_cidades = sorted(df['Cidade'].unique())
+    available_cidades = opcoes_filtros['cidades']
 
-default_cidades_validas = [c for c in st.session_state['selected_cidades'] if c in available_cidades]
+available_cidades_set = set(available_cidades)
+default_cidades_validas = [c for c in st.session_state['selected_cidades'] if c in available_cidades_set]
 selected_cidades = st.sidebar.multiselect(
     "Selecione a(s) Cidade(s)",
     options=available_cidades,
@@ -266,32 +421,47 @@ selected_cidades = st.sidebar.multiselect(
     key='cidade_filter'
 )
 
-# Filtro de Produto
-all_produtos = sorted(df['Produto'].unique())
+# Filtro de Produto: busca por nome ou SKU; o multiselect recebe só os resultados e a seleção atual
+busca_produto = st.sidebar.text_input(
+    "Buscar Produto (nome ou SKU)",
+    key='produto_busca',
+    placeholder="Digite parte do nome ou SKU"
+)
+produtos_ja_selecionados = st.session_state.get('produto_filter', st.session_state['selected_produtos'])
 selected_produtos = st.sidebar.multiselect(
     "Selecione o(s) Produto(s)",
-    options=all_produtos,
-    default=st.session_state['selected_produtos'],
+    options=list(dict.fromkeys(produtos_ja_selecionados + indice_produtos.buscar(busca_produto))),
+    default=produtos_ja_selecionados,
     key='produto_filter' # Adicionado key para controle do estado
 )
 
 # --- Aplica os Filtros Globais ---
-df_filtrado = df.copy()
-
-if selected_months:
-    df_filtrado = df_filtrado[df_filtrado['Mês'].isin(selected_months)]
-
-if selected_estados:
-    df_filtrado = df_filtrado[df_filtrado['Estado'].isin(selected_estados)]
-
-if selected_cidades:
-    df_filtrado = df_filtrado[df_filtrado['Cidade'].isin(selected_cidades)]
+# Selecionar todas as opções de um filtro equivale a não filtrar: normaliza para a mesma assinatura de cache
+assinatura = assinatura_filtros(
+    meses=[] if set(selected_months) == set(available_months) else selected_months,
+    estados=[] if set(selected_estados) == set(all_estados) else selected_estados,
+    cidades=[] if set(selected_cidades) == available_cidades_set else selected_cidades,
+    produtos=selected_produtos
+)
+# No modo out-of-core os dados filtrados não são materializados: as consultas leem mês a mês
+df_filtrado = None if modo_out_of_core else aplicar_filtros(dados, assinatura)
+# Modo aproximado: rankings e contagens distintas respondidos pelos sketches mensais.
+# Os sketches são particionados por Mês e Estado, então só valem sem filtro de cidade ou produto.
+modo_aproximado = sketches is not None and st.sidebar.checkbox(
+    "⚡ Modo aproximado (exploração rápida)",
+    value=False,
+    key='modo_aproximado',
+    help="Usa sketches pré-calculados (Top-K e HyperLogLog) para os rankings. Os valores exibidos informam a margem de erro."
+)
+usar_sketches = modo_aproximado and not assinatura[2] and not assinatura[3]
+if modo_aproximado and not usar_sketches:
+    st.sidebar.caption("O modo aproximado não se aplica com filtro de cidade ou produto; exibindo valores exatos.")
 
-if selected_produtos:
-    df_filtrado = df_filtrado[df_filtrado['Produto'].isin(selected_produtos)]
+# No modo aproximado, os rankings de produto e cidade vêm dos sketches: calcula apenas KPIs e Top Estados
+agregados = agregados_dashboard(dados, versao_dados, assinatura, ('Estado',) if usar_sketches else None)
 
 
-if df_filtrado.empty:
+if agregados['vazio']:
     st.warning("Nenhum dado encontrado para os filtros selecionados. Tente ajustar os filtros.")
     st.stop()
 
@@ -299,27 +469,17 @@ if df_filtrado.empty:
 st.header("📊 Principais Indicadores")
 
 # AJUSTADO: Lógica condicional para KPIs de Faturamento Total e Total Pedidos
-if selected_produtos:
-    # Se há produtos selecionados, os KPIs refletem os produtos filtrados
-    total_faturamento = df_filtrado['Faturamento do Produto'].sum()
-    total_pedidos_kpi = df_filtrado['Pedidos com Produto'].sum()
-else:
-    # Se não há produtos selecionados, os KPIs refletem o total da cidade
-    df_kpi_base = df_filtrado.groupby(['Mês', 'Cidade']).agg(
-        total_pedidos_cidade_mes=('Total de Pedidos da Cidade no Mês', 'first'),
-        faturamento_total_cidade_mes=('Faturamento Total da Cidade no Mês', 'first')
-    ).reset_index()
-    total_faturamento = df_kpi_base['faturamento_total_cidade_mes'].sum()
-    total_pedidos_kpi = df_kpi_base['total_pedidos_cidade_mes'].sum()
-
-
-total_unidades_fisicas = df_filtrado['Unidades Compradas'].sum()
+# Com produtos selecionados os KPIs refletem os produtos filtrados; sem produtos, o total da cidade
+kpis = agregados['kpis']
+total_faturamento = kpis['total_faturamento']
+total_pedidos_kpi = kpis['total_pedidos']
+total_unidades_fisicas = kpis['total_unidades_fisicas']
 
-# Calcula Ticket Médio Geral com base nos totais
-ticket_medio_geral = total_faturamento / total_pedidos_kpi if total_pedidos_kpi > 0 else 0
+# Ticket Médio Geral com base nos totais
+ticket_medio_geral = kpis['ticket_medio_geral']
 
 # Participação do produto no faturamento total da cidade (em %)
-media_participacao_faturamento = df_filtrado['Participação Faturamento Cidade Mês (%)'].mean()
+media_participacao_faturamento = kpis['media_participacao_faturamento']
 
 
 col1, col2, col3, col4, col5 = st.columns(5)
@@ -374,8 +534,10 @@ with tab_produtos:
     )
     n_produtos = st.slider("Número de Produtos no Top N:", min_value=5, max_value=20, value=10, key='n_produtos_tab')
 
-    top_produtos = df_filtrado.groupby('Produto')[metric_produto].sum().astype(float).nlargest(n_produtos).reset_index()
-    top_produtos.columns = ['Produto', 'Total']
+    if usar_sketches:
+        top_produtos, erro_top_produtos = sketches.top('Produto', metric_produto, assinatura[0], assinatura[1], n_produtos)
+    else:
+        top_produtos = agregados['tops'][('Produto', metric_produto)].head(n_produtos)
 
     fig_top_produtos = px.bar(
         top_produtos,
@@ -398,9 +560,20 @@ with tab_produtos:
     fig_top_produtos.update_layout(yaxis={'categoryorder': 'total ascending'})
     st.plotly_chart(fig_top_produtos, use_container_width=True)
 
+    if usar_sketches:
+        st.caption(legenda_modo_aproximado(metric_produto, erro_top_produtos))
+        if not assinatura[1]:
+            cidades_distintas = sketches.cidades_distintas_por_produto(assinatura[0])
+            st.dataframe(
+                top_produtos.assign(**{'Cidades Distintas (≈)': cidades_distintas.reindex(top_produtos['Produto']).round().astype(int).to_numpy()}),
+                use_container_width=True,
+                hide_index=True
+            )
+            st.caption(f"Cidades distintas estimadas por HyperLogLog (erro padrão de ±{sketches.erro_padrao_hll * 100:.1f}%).")
+
     st.subheader("Evolução do Desempenho dos Produtos ao Longo do Tempo")
 
-    all_months_prod_evol = sorted(df['Mês'].dt.to_period('M').unique().to_timestamp().tolist())
+    all_months_prod_evol = available_months
     default_prod_evol_month_selection = all_months_prod_evol
 
     selected_prod_evol_months = st.multiselect(
@@ -411,43 +584,68 @@ with tab_produtos:
         key='prod_evol_month_filter'
     )
 
-    df_filtered_for_prod_evol = df.copy()
-
-    if selected_prod_evol_months:
-        df_filtered_for_prod_evol = df_filtered_for_prod_evol[df_filtered_for_prod_evol['Mês'].isin(selected_prod_evol_months)]
-
-    if selected_estados:
-        df_filtered_for_prod_evol = df_filtered_for_prod_evol[df_filtered_for_prod_evol['Estado'].isin(selected_estados)]
-    if selected_cidades:
-        df_filtered_for_prod_evol = df_filtered_for_prod_evol[df_filtered_for_prod_evol['Cidade'].isin(selected_cidades)]
-
+    # Filtros de estado e cidade, sem copiar o DataFrame
     # 🔁 NÃO filtra por selected_produtos aqui para não limitar a lista do multiselect
+    assinatura_prod_evol = assinatura_filtros(
+        meses=selected_prod_evol_months,
+        estados=assinatura[1],
+        cidades=assinatura[2]
+    )
+    produtos_com_dados = produtos_presentes_dashboard(dados, versao_dados, assinatura_prod_evol)
 
-    if df_filtered_for_prod_evol.empty:
+    if not produtos_com_dados:
         st.info("Nenhum dado para mostrar na evolução de produtos com os filtros selecionados.")
     else:
-        produtos_para_linha_options = sorted(df_filtered_for_prod_evol['Produto'].unique())
+        default_prod_evol_selection_multiselect = [p for p in sorted(top_produtos['Produto'].tolist()[:3]) if p in produtos_com_dados]
+        produtos_linha_selecionados = [
+            p for p in st.session_state.get('produtos_para_linha_filter', default_prod_evol_selection_multiselect)
+            if p in produtos_com_dados
+        ]
 
-        default_prod_evol_selection_multiselect = [p for p in sorted(top_produtos['Produto'].tolist()[:3]) if p in produtos_para_linha_options]
+        busca_produto_linha = st.text_input(
+            "Buscar Produto para o Gráfico de Linha (nome ou SKU)",
+            key='produtos_para_linha_busca',
+            placeholder="Digite parte do nome ou SKU"
+        )
+        produtos_para_linha_options = list(dict.fromkeys(
+            produtos_linha_selecionados
+            + default_prod_evol_selection_multiselect
+            + indice_produtos.buscar(busca_produto_linha, permitidos=produtos_com_dados)
+        ))
 
         produtos_para_linha = st.multiselect(
             "Selecione Produtos para o Gráfico de Linha (máx 5):",
             options=produtos_para_linha_options,
-            default=default_prod_evol_selection_multiselect,
+            default=produtos_linha_selecionados,
             key='produtos_para_linha_filter'
         )
 
         # ✅ Agora sim aplica o filtro para os produtos selecionados
         if produtos_para_linha:
-            df_filtered_for_prod_evol = df_filtered_for_prod_evol[df_filtered_for_prod_evol['Produto'].isin(produtos_para_linha)]
-
-            df_produtos_tempo = df_filtered_for_prod_evol.groupby(['Mês', 'Produto']).agg(
-                faturamento=('Faturamento do Produto', 'sum'),
-                unidades_compradas=('Unidades Compradas', 'sum')
-            ).reset_index()
-            # Adiciona colunas com média móvel de 3 meses
-            df_produtos_tempo['faturamento_mm3'] = df_produtos_tempo.groupby('Produto')['faturamento'].transform(lambda x: x.rolling(3, min_periods=1).mean())
-            df_produtos_tempo['unidades_mm3'] = df_produtos_tempo.groupby('Produto')['unidades_compradas'].transform(lambda x: x.rolling(3, min_periods=1).mean())
+            # Faturamento e unidades por Mês/Produto, com média móvel de 3 meses
+            df_produtos_tempo = evolucao_produtos_dashboard(dados, versao_dados, assinatura_filtros(
+                meses=selected_prod_evol_months,
+                estados=assinatura[1],
+                cidades=assinatura[2],
+                produtos=produtos_para_linha
+            ))
+
+            # Projeção do próximo mês: liga o último mês realizado de cada produto ao valor previsto
+            df_projecao = None
+            # Nenhum mês selecionado equivale a todos os meses (assinatura sem filtro de mês)
+            meses_evol = selected_prod_evol_months or available_months
+            # A previsão precisa do histórico de todas as séries em memória: indisponível no modo out-of-core
+            if not modo_out_of_core and max(meses_evol) == available_months[-1]:
+                df_previsto = previsao_produtos(previsoes_dashboard(dados, versao_dados), assinatura_filtros(
+                    estados=assinatura[1],
+                    cidades=assinatura[2],
+                    produtos=produtos_para_linha
+                ))
+                if not df_previsto.empty:
+                    df_ultimo_mes = df_produtos_tempo[df_produtos_tempo['Mês'] == df_produtos_tempo['Mês'].max()]
+                    df_projecao = pd.concat(
+                        [df_ultimo_mes[df_previsto.columns], df_previsto], ignore_index=True
+                    ).sort_values(['Produto', 'Mês'])
 
             fig_prod_tempo_fat = px.line(
                 df_produtos_tempo,
@@ -465,6 +663,12 @@ with tab_produtos:
                                    mode='lines', name=f'{produto} (MM3)',
                                    line=dict(dash='dot'))
 
+            if df_projecao is not None:
+                for produto, df_aux in df_projecao.groupby('Produto'):
+                    fig_prod_tempo_fat.add_scatter(x=df_aux['Mês'], y=df_aux['faturamento'],
+                                       mode='lines+markers', name=f'{produto} (Previsão)',
+                                       line=dict(dash='dash'))
+
             fig_prod_tempo_fat.update_xaxes(dtick="M1", tickformat="%Y-%m")
             fig_prod_tempo_fat.update_yaxes(tickprefix="R$ ", tickformat=",.2f") # US locale for numbers, R$ prefix
             fig_prod_tempo_fat.update_traces(hovertemplate='Mês: %{x|%Y-%m}<br>Produto: %{fullData.name}<br>Faturamento: R$ %{y:,.2f}<extra></extra>')
@@ -479,43 +683,47 @@ with tab_produtos:
                 labels={'Mês': 'Mês', 'unidades_compradas': 'Unidades Compradas', 'Produto': 'Produto'},
                 line_shape='linear'
             )
+            if df_projecao is not None:
+                for produto, df_aux in df_projecao.groupby('Produto'):
+                    fig_prod_tempo_unid.add_scatter(x=df_aux['Mês'], y=df_aux['unidades_compradas'],
+                                        mode='lines+markers', name=f'{produto} (Previsão)',
+                                        line=dict(dash='dash'))
             fig_prod_tempo_unid.update_xaxes(dtick="M1", tickformat="%Y-%m")
             fig_prod_tempo_unid.update_yaxes(tickformat="")
             fig_prod_tempo_unid.update_traces(
                 hovertemplate='Mês: %{x|%Y-%m}<br>Produto: %{fullData.name}<br>Unidades: %{y:,.0f}<extra></extra>'
 )
             st.plotly_chart(fig_prod_tempo_unid, use_container_width=True)
-#INSIGTHS 
-            st.subheader("🔍 Insights Automáticos: Variação Mês a Mês dos Produtos")
-
-        if len(selected_prod_evol_months) >= 2 and not df_produtos_tempo.empty:
-            df_insights = df_produtos_tempo.copy()
-            df_insights['Mês'] = df_insights['Mês'].dt.to_period('M')
-            df_insights = df_insights.sort_values(['Produto', 'Mês'])
-
-            df_insights['unidades_pct_change'] = df_insights.groupby('Produto')['unidades_compradas'].pct_change()
-            df_insights['faturamento_pct_change'] = df_insights.groupby('Produto')['faturamento'].pct_change()
-
-            ult_mes = df_insights['Mês'].max()
-            penult_mes = sorted(df_insights['Mês'].unique())[-2]
-
-            ult_var = df_insights[df_insights['Mês'] == ult_mes]
-
-            for _, row in ult_var.iterrows():
-                produto = row['Produto']
-                unid_pct = row['unidades_pct_change']
-                fat_pct = row['faturamento_pct_change']
-
-                if not pd.isna(unid_pct) and abs(unid_pct) > 0.05:
-                    simbolo = "🟢⬆️" if unid_pct > 0 else "🔴⬇️"
-                    st.markdown(f"{simbolo} **{produto}** teve variação de **{unid_pct*100:.1f}%** em *unidades* de {penult_mes} para {ult_mes}.")
-
-                if not pd.isna(fat_pct) and abs(fat_pct) > 0.05:
-                    simbolo = "🟢⬆️" if fat_pct > 0 else "🔴⬇️"
-                    st.markdown(f"{simbolo} **{produto}** teve variação de **{fat_pct*100:.1f}%** em *faturamento* de {penult_mes} para {ult_mes}.")
+            if df_projecao is not None:
+                st.caption("Linhas tracejadas: previsão do próximo mês (sazonal ingênuo, tendência linear ou suavização exponencial, o de menor erro recente em cada produto × cidade).")
+
+    # Insights: anomalias de todo o catálogo (calculadas uma vez por versão dos dados), dentro dos filtros
+    st.subheader("🔍 Insights Automáticos: Anomalias em Produtos e Cidades")
+    if modo_out_of_core:
+        # As anomalias precisam do histórico de todas as séries em memória: indisponível neste modo
+        st.info("Os insights automáticos não estão disponíveis no modo out-of-core.")
+    else:
+        n_insights = st.slider("Número de Insights:", min_value=5, max_value=30, value=10, key='n_insights')
+        df_insights = insights_dashboard(dados, versao_dados, assinatura_filtros(
+            meses=selected_prod_evol_months,
+            estados=assinatura[1],
+            cidades=assinatura[2],
+            produtos=assinatura[3]
+        ), n_insights)
+
+        if df_insights.empty:
+            st.info("Nenhuma anomalia encontrada para os filtros selecionados.")
         else:
-            st.info("Selecione ao menos dois meses para gerar os insights automáticos.")
-
+            for mes, produto, estado, cidade, metrica, valor, base, variacao, z in df_insights.itertuples(index=False, name=None):
+                simbolo = "🟢⬆️" if variacao > 0 else "🔴⬇️"
+                local = f"**{produto}** em {cidade}/{estado} ({mes.strftime('%Y-%m')})"
+                if metrica == 'Participação Faturamento Cidade Mês (%)':
+                    st.markdown(f"{simbolo} {local}: participação no faturamento da cidade de **{valor:,.2f}%**, contra {base:,.2f}% nos meses anteriores ({variacao:+,.2f} p.p.; z = {z:+.1f}).")
+                elif metrica == 'Faturamento do Produto':
+                    st.markdown(f"{simbolo} {local}: faturamento de **{format_currency_br(valor)}**, contra média de {format_currency_br(base)} nos meses anteriores (z = {z:+.1f}).")
+                else:
+                    st.markdown(f"{simbolo} {local}: **{format_integer_br(valor)}** unidades, contra média de {format_integer_br(base)} nos meses anteriores (z = {z:+.1f}).")
+            st.caption(f"Variações com |z| ≥ {LIMIAR_Z:.0f} em relação aos {JANELA_BASE} meses anteriores de cada produto × cidade, ordenadas por |z|.")
 
 with tab_cidades:
     st.subheader("Top Cidades por Métrica")
@@ -526,23 +734,11 @@ with tab_cidades:
     )
     n_cidades = st.slider("Número de Cidades no Top N:", min_value=5, max_value=20, value=10, key='n_cidades_tab')
 
-    if selected_produtos:
-        if metric_cidade == "Faturamento Total da Cidade no Mês":
-            top_cidades = df_filtrado.groupby('Cidade')['Faturamento do Produto'].sum().astype(float).nlargest(n_cidades).reset_index()
-        elif metric_cidade == "Unidades Compradas":
-            top_cidades = df_filtrado.groupby('Cidade')['Unidades Compradas'].sum().astype(float).nlargest(n_cidades).reset_index()
-        else:
-            top_cidades = df_filtrado.groupby('Cidade')['Pedidos com Produto'].sum().astype(float).nlargest(n_cidades).reset_index()
+    # Com produtos selecionados, "Faturamento" usa o faturamento dos produtos
+    if usar_sketches:
+        top_cidades, erro_top_cidades = sketches.top('Cidade', metric_cidade, assinatura[0], assinatura[1], n_cidades)
     else:
-        if metric_cidade == "Faturamento Total da Cidade no Mês":
-            top_cidades_agg = df_filtrado.groupby(['Mês', 'Cidade'])['Faturamento Total da Cidade no Mês'].first().reset_index()
-            top_cidades = top_cidades_agg.groupby('Cidade')['Faturamento Total da Cidade no Mês'].sum().astype(float).nlargest(n_cidades).reset_index()
-        elif metric_cidade == "Unidades Compradas":
-            top_cidades = df_filtrado.groupby('Cidade')['Unidades Compradas'].sum().astype(float).nlargest(n_cidades).reset_index()
-        else:
-            top_cidades = df_filtrado.groupby('Cidade')['Pedidos com Produto'].sum().astype(float).nlargest(n_cidades).reset_index()
-
-    top_cidades.columns = ['Cidade', 'Total']
+        top_cidades = agregados['tops'][('Cidade', metric_cidade)].head(n_cidades)
     fig_top_cidades = px.bar(
         top_cidades,
         x='Total',
@@ -567,6 +763,9 @@ with tab_cidades:
     fig_top_cidades.update_layout(yaxis={'categoryorder': 'total ascending'})
     st.plotly_chart(fig_top_cidades, use_container_width=True)
 
+    if usar_sketches:
+        st.caption(legenda_modo_aproximado(metric_cidade, erro_top_cidades))
+
 with tab_estados:
     st.subheader("Top Estados por Métrica")
     metric_estado = st.selectbox(
@@ -576,23 +775,8 @@ with tab_estados:
     )
     n_estados = st.slider("Número de Estados no Top N:", min_value=5, max_value=20, value=10, key='n_estados_tab')
 
-    if selected_produtos:
-        if metric_estado == "Faturamento Total da Cidade no Mês":
-            top_estados = df_filtrado.groupby('Estado')['Faturamento do Produto'].sum().astype(float).nlargest(n_estados).reset_index()
-        elif metric_estado == "Unidades Compradas":
-            top_estados = df_filtrado.groupby('Estado')['Unidades Compradas'].sum().astype(float).nlargest(n_estados).reset_index()
-        else:
-            top_estados = df_filtrado.groupby('Estado')['Pedidos com Produto'].sum().astype(float).nlargest(n_estados).reset_index()
-    else:
-        if metric_estado == "Faturamento Total da Cidade no Mês":
-            top_estados_agg = df_filtrado.groupby(['Mês', 'Estado'])['Faturamento Total da Cidade no Mês'].sum().reset_index()
-            top_estados = top_estados_agg.groupby('Estado')['Faturamento Total da Cidade no Mês'].sum().astype(float).nlargest(n_estados).reset_index()
-        elif metric_estado == "Unidades Compradas":
-            top_estados = df_filtrado.groupby('Estado')['Unidades Compradas'].sum().astype(float).nlargest(n_estados).reset_index()
-        else:
-            top_estados = df_filtrado.groupby('Estado')['Pedidos com Produto'].sum().astype(float).nlargest(n_estados).reset_index()
-
-    top_estados.columns = ['Estado', 'Total']
+    # Com produtos selecionados, "Faturamento" usa o faturamento dos produtos
+    top_estados = agregados['tops'][('Estado', metric_estado)].head(n_estados)
     fig_top_estados = px.bar(
         top_estados,
         x='Total',
@@ -617,6 +801,15 @@ with tab_estados:
     fig_top_estados.update_layout(yaxis={'categoryorder': 'total ascending'})
     st.plotly_chart(fig_top_estados, use_container_width=True)
 
+    if usar_sketches:
+        cidades_distintas_estado = sketches.cidades_distintas_por_estado(assinatura[0])
+        st.dataframe(
+            top_estados.assign(**{'Cidades Distintas (≈)': cidades_distintas_estado.reindex(top_estados['Estado']).round().astype(int).to_numpy()}),
+            use_container_width=True,
+            hide_index=True
+        )
+        st.caption(f"Cidades distintas estimadas por HyperLogLog (erro padrão de ±{sketches.erro_padrao_hll * 100:.1f}%).")
+
 st.markdown("---")
 
 # --- Comparativos de Período ---
@@ -628,49 +821,26 @@ with st.container():
         # Cria as colunas dentro do container
         col_comp1, col_comp2 = st.columns(2)
 
-        # Base para comparativos: df original (não filtrado), depois aplica os filtros
-        df_base_comp = df.copy()
-        if selected_cidades:
-            df_base_comp = df_base_comp[df_base_comp['Cidade'].isin(selected_cidades)]
-        if selected_estados:
-            df_base_comp = df_base_comp[df_base_comp['Estado'].isin(selected_estados)]
+        # Base para comparativos: dados originais (sem o filtro de meses), com os filtros de estado e cidade
+        def assinatura_periodo(inicio, fim):
+            meses_periodo = [m for m in available_months if inicio <= m <= fim]
+            return assinatura_filtros(meses=meses_periodo, estados=assinatura[1], cidades=assinatura[2], produtos=selected_produtos)
 
         # Condição para faturamento e pedidos: se houver produto selecionado, usa métricas de produto
         if selected_produtos:
             st.info("Comparativos calculados usando 'Faturamento do Produto' e 'Pedidos com Produto' (produto(s) selecionado(s)).")
-
-            df_current_period_for_comp = df_base_comp[(df_base_comp['Mês'] >= min(selected_months)) & (df_base_comp['Mês'] <= max(selected_months)) & \
-                                                     df_base_comp['Produto'].isin(selected_produtos)]
-            df_previous_month = df_base_comp[(df_base_comp['Mês'] >= (min(selected_months) - pd.DateOffset(months=1))) & (df_base_comp['Mês'] <= (min(selected_months) - pd.DateOffset(days=1))) & \
-                                             df_base_comp['Produto'].isin(selected_produtos)]
-            df_three_months_ago = df_base_comp[(df_base_comp['Mês'] >= (min(selected_months) - pd.DateOffset(months=3))) & (df_base_comp['Mês'] <= (min(selected_months) - pd.DateOffset(days=1))) & \
-                                             df_base_comp['Produto'].isin(selected_produtos)]
-
-            current_faturamento_base_comp = df_current_period_for_comp['Faturamento do Produto'].sum()
-            current_pedidos_base_comp = df_current_period_for_comp['Pedidos com Produto'].sum()
-
-            previous_faturamento_base_comp = df_previous_month['Faturamento do Produto'].sum()
-            previous_pedidos_base_comp = df_previous_month['Pedidos com Produto'].sum()
-
-            three_months_faturamento_base_comp = df_three_months_ago['Faturamento do Produto'].sum()
-            three_months_pedidos_base_comp = df_three_months_ago['Pedidos com Produto'].sum()
-
         else: # Se nenhum produto for selecionado, usa faturamento total da cidade
             st.info("Comparativos calculados usando 'Faturamento Total da Cidade no Mês' e 'Total de Pedidos da Cidade no Mês'.")
 
-            df_current_period_for_comp = df_base_comp[(df_base_comp['Mês'] >= min(selected_months)) & (df_base_comp['Mês'] <= max(selected_months))]
-            df_previous_month = df_base_comp[(df_base_comp['Mês'] >= (min(selected_months) - pd.DateOffset(months=1))) & (df_base_comp['Mês'] <= (min(selected_months) - pd.DateOffset(days=1)))]
-            df_three_months_ago = df_base_comp[(df_base_comp['Mês'] >= (min(selected_months) - pd.DateOffset(months=3))) & (df_base_comp['Mês'] <= (min(selected_months) - pd.DateOffset(days=1)))]
-
-            # Agregações para o período (faturamento total da cidade)
-            current_faturamento_base_comp = df_current_period_for_comp.groupby(['Mês', 'Cidade'])['Faturamento Total da Cidade no Mês'].first().sum()
-            current_pedidos_base_comp = df_current_period_for_comp.groupby(['Mês', 'Cidade'])['Total de Pedidos da Cidade no Mês'].first().sum()
-
-            previous_faturamento_base_comp = df_previous_month.groupby(['Mês', 'Cidade'])['Faturamento Total da Cidade no Mês'].first().sum()
-            previous_pedidos_base_comp = df_previous_month.groupby(['Mês', 'Cidade'])['Total de Pedidos da Cidade no Mês'].first().sum()
-
-            three_months_faturamento_base_comp = df_three_months_ago.groupby(['Mês', 'Cidade'])['Faturamento Total da Cidade no Mês'].first().sum()
-            three_months_pedidos_base_comp = df_three_months_ago.groupby(['Mês', 'Cidade'])['Total de Pedidos da Cidade no Mês'].first().sum()
+        current_faturamento_base_comp, current_pedidos_base_comp, _ = comparativo_dashboard(
+            dados, versao_dados, assinatura_periodo(min(selected_months), max(selected_months))
+        )
+        previous_faturamento_base_comp, previous_pedidos_base_comp, _ = comparativo_dashboard(
+            dados, versao_dados, assinatura_periodo(min(selected_months) - pd.DateOffset(months=1), min(selected_months) - pd.DateOffset(days=1))
+        )
+        three_months_faturamento_base_comp, three_months_pedidos_base_comp, num_unique_months_3m = comparativo_dashboard(
+            dados, versao_dados, assinatura_periodo(min(selected_months) - pd.DateOffset(months=3), min(selected_months) - pd.DateOffset(days=1))
+        )
 
         # Calcular variações (lógica idêntica, apenas os valores de base mudam)
         fat_diff_prev = current_faturamento_base_comp - previous_faturamento_base_comp
@@ -679,7 +849,6 @@ with st.container():
         ped_diff_prev = current_pedidos_base_comp - previous_pedidos_base_comp
         ped_perc_prev = (ped_diff_prev / previous_pedidos_base_comp * 100) if previous_pedidos_base_comp > 0 else 0
 
-        num_unique_months_3m = len(df_three_months_ago['Mês'].dt.to_period('M').unique())
         avg_3m_faturamento = (three_months_faturamento_base_comp / num_unique_months_3m) if num_unique_months_3m > 0 else 0
         avg_3m_pedidos = (three_months_pedidos_base_comp / num_unique_months_3m) if num_unique_months_3m > 0 else 0
 
@@ -738,8 +907,13 @@ sort_column_actual = sort_column_options[sort_column_display] # Obtém o nome da
 sort_order = st.radio("Ordem:", options=["Decrescente", "Crescente"], index=0, key='sort_order_table')
 ascending = True if sort_order == "Crescente" else False
 
-# Ordenar o DataFrame filtrado ANTES de formatar para exibição
-df_sorted = df_filtrado.sort_values(by=sort_column_actual, ascending=ascending)
+# Ordenar o DataFrame filtrado ANTES de formatar para exibição (métricas derivadas calculadas só para as linhas filtradas)
+if modo_out_of_core:
+    # Mantém em memória apenas as primeiras linhas da ordenação, lendo um mês por vez
+    df_sorted = tabela_detalhada_out_of_core(dados, versao_dados, assinatura, sort_column_actual, ascending)
+    st.caption("Modo out-of-core: exibindo as 1.000 primeiras linhas na ordenação escolhida. Use o export para obter todos os dados.")
+else:
+    df_sorted = tabela_detalhada_dashboard(df_filtrado, versao_dados, assinatura, sort_column_actual, ascending)
 
 # Agora, selecione as colunas para exibição e formate
 df_exibir_formatted = df_sorted[columns_to_display].copy()
@@ -760,88 +934,113 @@ st.dataframe(
 # Download dos dados
 st.header("📥 Export de Dados")
 
-col1, col2 = st.columns(2)
+col1, col2, col3 = st.columns(3)
 
+# Prefixo dos arquivos temporários de export e idade a partir da qual um arquivo esquecido é apagado
+PREFIXO_EXPORT = 'dashboard_export_'
+IDADE_MAXIMA_EXPORT_SEGUNDOS = 3600
+
+def limpar_exports_antigos():
+    # Arquivos que sobraram de gerações interrompidas (ex.: processo encerrado no meio do export)
+    diretorio = tempfile.gettempdir()
+    limite = time.time() - IDADE_MAXIMA_EXPORT_SEGUNDOS
+    for nome in os.listdir(diretorio):
+        caminho = os.path.join(diretorio, nome)
+        try:
+            if nome.startswith(PREFIXO_EXPORT) and os.path.getmtime(caminho) < limite:
+                os.remove(caminho)
+        except OSError:
+            # Apagado por outra sessão ao mesmo tempo
+            pass
+
+def exportacao_sob_demanda(tipo, gerar, rotulo, nome_arquivo, mime):
+    """
+    Gera o arquivo de export só quando o usuário pede, gravando-o em um arquivo temporário.
+    O download é oferecido apenas na execução que gerou o arquivo: nas seguintes o conteúdo não fica
+    retido na memória do Streamlit. O arquivo temporário é apagado logo após a leitura, mesmo se a geração falhar.
+    """
+    if not st.button(f"⚙️ Gerar {rotulo}", key=f'gerar_{tipo}'):
+        return
+    limpar_exports_antigos()
+    with st.spinner("Gerando arquivo... Por favor, aguarde."):
+        arquivo = tempfile.NamedTemporaryFile(prefix=f'{PREFIXO_EXPORT}{tipo}_', suffix=os.path.splitext(nome_arquivo)[1], delete=False)
+        try:
+            with arquivo:
+                gerar(arquivo)
+            with open(arquivo.name, 'rb') as gerado:
+                conteudo = gerado.read()
+        finally:
+            os.remove(arquivo.name)
+    st.download_button(label=f"📥 Download {rotulo}", data=conteudo, file_name=nome_arquivo, mime=mime, key=f'download_{tipo}')
+
+def blocos_exportacao():
+    # Em memória, o DataFrame já filtrado; no modo out-of-core, um bloco por mês lido do disco
+    return [df_filtrado] if df_filtrado is not None else dados.iterar(assinatura)
+
+def blocos_exportacao_detalhados():
+    # Dados filtrados com as métricas derivadas e, em memória, a previsão do próximo mês de cada série Produto × Cidade
+    blocos = (adicionar_metricas(bloco) for bloco in blocos_exportacao())
+    if modo_out_of_core:
+        return blocos
+    return anexar_previsao(blocos, previsoes_dashboard(dados, versao_dados))
+
+def resumo_exportacao():
+    # Resumo executivo numérico por Mês/Cidade/Estado; cada bloco contém meses completos
+    return pd.concat([calcular_resumo(bloco) for bloco in blocos_exportacao()], ignore_index=True)
+
+def gerar_resumo_csv(saida):
+    resumo_final = resumo_exportacao()
+
+    # Formata colunas para o CSV de resumo
+    resumo_final['Mês'] = resumo_final['Mês'].dt.strftime('%Y-%m')
+    resumo_final['Faturamento Total Produtos Selecionados'] = resumo_final['Faturamento Total Produtos Selecionados'].apply(format_currency_br)
+    resumo_final['Unidades Compradas Produtos Selecionados'] = resumo_final['Unidades Compradas Produtos Selecionados'].apply(format_integer_br) # APLICAR AQUI
+    resumo_final['Pedidos com Produtos Selecionados'] = resumo_final['Pedidos com Produtos Selecionados'].apply(format_integer_br) # APLICAR AQUI
+    resumo_final['Total de Pedidos da Cidade no Mês'] = resumo_final['Total de Pedidos da Cidade no Mês'].apply(format_integer_br) # APLICAR AQUI
+    resumo_final['Faturamento Total da Cidade no Mês'] = resumo_final['Faturamento Total da Cidade no Mês'].apply(format_currency_br)
+    resumo_final['Participação Faturamento Cidade Mês (%)'] = resumo_final['Participação Faturamento Cidade Mês (%)'].apply(lambda x: f"{x:,.2f}%")
+    resumo_final['Participação Pedidos Cidade Mês (%)'] = resumo_final['Participação Pedidos Cidade Mês (%)'].apply(lambda x: f"{x:,.2f}%")
+    resumo_final['Ticket Médio Geral Cidade'] = resumo_final['Ticket Médio Geral Cidade'].apply(format_currency_br)
+
+    gerar_csv(resumo_final, saida)
+
+# Os exports percorrem todo o histórico filtrado (no modo out-of-core, mês a mês no disco):
+# são gerados apenas quando pedidos, direto para arquivos temporários
 with col1:
-    if not df_filtrado.empty:
-        csv = df_filtrado.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="📥 Download Dados Filtrados CSV",
-            data=csv,
-            file_name=f"dados_filtrados_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
+    if not agregados['vazio']:
+        exportacao_sob_demanda(
+            'csv',
+            lambda saida: gerar_csv(blocos_exportacao_detalhados(), saida),
+            "Dados Filtrados CSV",
+            f"dados_filtrados_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            "text/csv"
         )
 
 with col2:
-    if not df_filtrado.empty:
-        # Resumo executivo (agregado pelos filtros aplicados)
-        resumo = df_filtrado.groupby(['Mês', 'Cidade', 'Estado']).agg(
-            faturamento_total_produtos_selecionados=('Faturamento do Produto', 'sum'),
-            unidades_compradas_total_produtos_selecionadas=('Unidades Compradas', 'sum'),
-            pedidos_com_produto_selecionado=('Pedidos com Produto', 'sum'),
-            total_pedidos_cidade_mes_unique=('Total de Pedidos da Cidade no Mês', 'first'),
-            faturamento_total_cidade_mes_unique=('Faturamento Total da Cidade no Mês', 'first')
-        ).reset_index()
-
-        # CRITICAL FIX: Ensure columns exist in 'resumo' after aggregation, especially for empty/NaN groups
-        expected_agg_cols = ['faturamento_total_produtos_selecionados', 'unidades_compradas_total_produtos_selecionadas', 'pedidos_com_produto_selecionado',
-                             'total_pedidos_cidade_mes_unique', 'faturamento_total_cidade_mes_unique']
-        for col in expected_agg_cols:
-            if col not in resumo.columns:
-                resumo[col] = 0.0 # Add missing column with default value if not created by agg
-
-        # Recalcula participações e ticket médio para o resumo
-        resumo['Participação Faturamento Cidade Mês (%)'] = np.where(
-            resumo['faturamento_total_cidade_mes_unique'] == 0,
-            0,
-            (resumo['faturamento_total_produtos_selecionados'] / resumo['faturamento_total_cidade_mes_unique']) * 100
-        )
-        resumo['Participação Pedidos Cidade Mês (%)'] = np.where(
-            resumo['total_pedidos_cidade_mes_unique'] == 0,
-            0,
-            (resumo['pedidos_com_produto_selecionado'] / resumo['total_pedidos_cidade_mes_unique']) * 100
-        )
-        resumo['Ticket Médio Geral Cidade'] = np.where(
-            resumo['pedidos_com_produto_selecionado'] == 0,
-            0,
-            resumo['faturamento_total_produtos_selecionados'] / resumo['pedidos_com_produto_selecionado']
+    if not agregados['vazio']:
+        exportacao_sob_demanda(
+            'resumo',
+            gerar_resumo_csv,
+            "Resumo Executivo CSV",
+            f"resumo_executivo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            "text/csv"
         )
 
-        # Selecionar e renomear colunas para o CSV de resumo
-        resumo_final_cols = [
-            'Mês', 'Cidade', 'Estado',
-            'faturamento_total_produtos_selecionados',
-            'unidades_compradas_total_produtos_selecionadas',
-            'pedidos_com_produto_selecionado',
-            'total_pedidos_cidade_mes_unique',
-            'faturamento_total_cidade_mes_unique',
-            'Participação Faturamento Cidade Mês (%)',
-            'Participação Pedidos Cidade Mês (%)',
-            'Ticket Médio Geral Cidade'
-        ]
-        resumo_final = resumo[resumo_final_cols].rename(columns={
-            'faturamento_total_produtos_selecionados': 'Faturamento Total Produtos Selecionados',
-            'unidades_compradas_total_produtos_selecionadas': 'Unidades Compradas Produtos Selecionados',
-            'pedidos_com_produto_selecionado': 'Pedidos com Produtos Selecionados',
-            'total_pedidos_cidade_mes_unique': 'Total de Pedidos da Cidade no Mês',
-            'faturamento_total_cidade_mes_unique': 'Faturamento Total da Cidade no Mês'
-        })
-
-        # Formata colunas para o CSV de resumo
-        resumo_final['Mês'] = resumo_final['Mês'].dt.strftime('%Y-%m')
-        resumo_final['Faturamento Total Produtos Selecionados'] = resumo_final['Faturamento Total Produtos Selecionados'].apply(format_currency_br)
-        resumo_final['Unidades Compradas Produtos Selecionados'] = resumo_final['Unidades Compradas Produtos Selecionados'].apply(format_integer_br) # APLICAR AQUI
-        resumo_final['Pedidos com Produtos Selecionados'] = resumo_final['Pedidos com Produtos Selecionados'].apply(format_integer_br) # APLICAR AQUI
-        resumo_final['Total de Pedidos da Cidade no Mês'] = resumo_final['Total de Pedidos da Cidade no Mês'].apply(format_integer_br) # APLICAR AQUI
-        resumo_final['Faturamento Total da Cidade no Mês'] = resumo_final['Faturamento Total da Cidade no Mês'].apply(format_currency_br)
-        resumo_final['Participação Faturamento Cidade Mês (%)'] = resumo_final['Participação Faturamento Cidade Mês (%)'].apply(lambda x: f"{x:,.2f}%")
-        resumo_final['Participação Pedidos Cidade Mês (%)'] = resumo_final['Participação Pedidos Cidade Mês (%)'].apply(lambda x: f"{x:,.2f}%")
-        resumo_final['Ticket Médio Geral Cidade'] = resumo_final['Ticket Médio Geral Cidade'].apply(format_currency_br)
-
-        csv_resumo = resumo_final.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="📊 Download Resumo Executivo CSV",
-            data=csv_resumo,
-            file_name=f"resumo_executivo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-            mime="text/csv"
-        )
\ No newline at end of file
+with col3:
+    if not agregados['vazio']:
+        # Excel com dados brutos, resumo e rankings em abas separadas; números nativos com formato pt-BR
+        def formato_metrica(metrica):
+            return 'moeda' if 'Faturamento' in metrica else 'inteiro'
+
+        tops_excel = {
+            f"Top {n_produtos} Produtos": (top_produtos, formato_metrica(metric_produto)),
+            f"Top {n_cidades} Cidades": (top_cidades, formato_metrica(metric_cidade)),
+            f"Top {n_estados} Estados": (top_estados, formato_metrica(metric_estado)),
+        }
+        exportacao_sob_demanda(
+            'excel',
+            lambda saida: gerar_excel(blocos_exportacao_detalhados(), resumo_exportacao(), tops_excel, saida),
+            "Excel (Dados, Resumo e Top N)",
+            f"export_dashboard_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
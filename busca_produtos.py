@@ -0,0 +1,132 @@
+import bisect
+import re
+import unicodedata
+
+import numpy as np
+
+# Quantidade padrão de opções devolvidas ao widget de seleção
+LIMITE_RESULTADOS_PADRAO = 50
+
+# Pesos do ranking: quanto menor, mais relevante
+_RANK_EXATO = 0
+_RANK_PREFIXO_NOME = 1
+_RANK_PREFIXO_PALAVRA = 2
+_RANK_SUBSTRING = 3
+
+
+def normalizar_texto(texto):
+    """
+    Minúsculas e sem acentos, para buscas tolerantes a "Papel"/"papél".
+    """
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return texto.lower().strip()
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceProdutos:
+    """
+    Índice de busca por nome de produto e SKU: prefixo de palavras (lista ordenada + bisect)
+    e n-gramas (trigramas) para buscas por trecho. Construído uma vez por versão dos dados.
+    """
+
+    def __init__(self, df):
+        agregado = df.groupby('Produto', observed=True).agg(
+            faturamento=('Faturamento do Produto', 'sum'),
+            skus=('SKU', lambda s: sorted({str(v) for v in s.dropna()}))
+        )
+        # Produtos com maior faturamento aparecem primeiro em caso de empate
+        agregado = agregado.sort_values('faturamento', ascending=False, kind='stable')
+
+        self.produtos = [str(p) for p in agregado.index]
+        self._textos = []
+        self._skus = []
+        palavras = []
+        self._trigramas = {}
+
+        for pid, (produto, skus) in enumerate(zip(self.produtos, agregado['skus'])):
+            nome = normalizar_texto(produto)
+            skus_norm = [normalizar_texto(sku) for sku in skus]
+            self._textos.append(nome)
+            self._skus.append(skus_norm)
+
+            for palavra in set(re.split(r'\W+', nome)) | set(skus_norm):
+                if palavra:
+                    palavras.append((palavra, pid))
+            for texto in [nome] + skus_norm:
+                for trigrama in _trigramas(texto):
+                    self._trigramas.setdefault(trigrama, set()).add(pid)
+
+        palavras.sort()
+        self._palavras = [p for p, _ in palavras]
+        self._palavras_pid = [pid for _, pid in palavras]
+        self._trigramas = {t: np.fromiter(sorted(pids), dtype=np.int64) for t, pids in self._trigramas.items()}
+
+    def _por_prefixo(self, consulta):
+        inicio = bisect.bisect_left(self._palavras, consulta)
+        fim = bisect.bisect_left(self._palavras, consulta + '\uffff')
+        return set(self._palavras_pid[inicio:fim])
+
+    def _por_trecho(self, consulta):
+        trigramas = _trigramas(consulta)
+        if not trigramas:
+            return set()
+        listas = [self._trigramas.get(t) for t in trigramas]
+        if any(lista is None for lista in listas):
+            return set()
+        listas.sort(key=len)
+        candidatos = listas[0]
+        for lista in listas[1:]:
+            candidatos = np.intersect1d(candidatos, lista, assume_unique=True)
+            if candidatos.size == 0:
+                return set()
+        # Trigramas em comum não garantem o trecho completo: confirma no texto
+        return {
+            int(pid) for pid in candidatos
+            if consulta in self._textos[pid] or any(consulta in sku for sku in self._skus[pid])
+        }
+
+    def buscar(self, consulta, limite=LIMITE_RESULTADOS_PADRAO, permitidos=None):
+        """
+        Retorna até `limite` nomes de produto que casam com a consulta (nome ou SKU),
+        ordenados por relevância e, em seguida, por faturamento.
+        Consulta vazia devolve os produtos de maior faturamento.
+        `permitidos`, se informado, restringe o resultado a esse conjunto de nomes.
+        """
+        consulta = normalizar_texto(consulta or '')
+
+        if not consulta:
+            candidatos = range(len(self.produtos))
+            ranqueados = ((_RANK_EXATO, pid) for pid in candidatos)
+        else:
+            # Cada palavra da consulta precisa casar (por prefixo ou trecho) com o nome ou SKU
+            palavras = [p for p in re.split(r'\W+', consulta) if p] or [consulta]
+            por_prefixo = set.intersection(*(self._por_prefixo(p) for p in palavras))
+            encontrados = set.intersection(*(self._por_prefixo(p) | self._por_trecho(p) for p in palavras))
+            ranqueados = []
+            for pid in encontrados | self._por_trecho(consulta):
+                nome = self._textos[pid]
+                if nome == consulta or consulta in self._skus[pid]:
+                    rank = _RANK_EXATO
+                elif nome.startswith(consulta):
+                    rank = _RANK_PREFIXO_NOME
+                elif pid in por_prefixo:
+                    rank = _RANK_PREFIXO_PALAVRA
+                else:
+                    rank = _RANK_SUBSTRING
+                ranqueados.append((rank, pid))
+            # O id do produto já reflete a ordem de faturamento
+            ranqueados.sort()
+
+        resultado = []
+        for _, pid in ranqueados:
+            produto = self.produtos[pid]
+            if permitidos is not None and produto not in permitidos:
+                continue
+            resultado.append(produto)
+            if len(resultado) >= limite:
+                break
+        return resultado
@@ -0,0 +1,67 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from agregacoes import assinatura_filtros
+
+logger = logging.getLogger(__name__)
+
+
+def assinaturas_quentes(available_months, estados, ultimos_meses=3):
+    """
+    Lista as combinações de filtros mais acessadas logo após uma carga de dados:
+    a seleção padrão (todos os meses e estados), cada estado isolado,
+    o último mês e os últimos N meses.
+    """
+    assinaturas = [assinatura_filtros()]
+
+    for estado in estados:
+        assinaturas.append(assinatura_filtros(estados=[estado]))
+
+    meses_ordenados = sorted(available_months)
+    if meses_ordenados:
+        assinaturas.append(assinatura_filtros(meses=meses_ordenados[-1:]))
+    if ultimos_meses > 1 and len(meses_ordenados) > ultimos_meses:
+        assinaturas.append(assinatura_filtros(meses=meses_ordenados[-ultimos_meses:]))
+
+    # Remove duplicadas mantendo a ordem de prioridade
+    return list(dict.fromkeys(assinaturas))
+
+
+class CacheWarmer:
+    """
+    Pré-calcula em segundo plano, com um número limitado de threads,
+    os resultados cacheados das assinaturas de filtro mais comuns.
+    Cada versão dos dados é aquecida uma única vez.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cache-warmer")
+        self._versoes_agendadas = set()
+        self._lock = threading.Lock()
+
+    def agendar(self, versao_dados, assinaturas, tarefa, tarefas_versao=()):
+        """
+        Agenda `tarefa(assinatura)` para cada assinatura, caso a versão ainda não tenha sido aquecida.
+        `tarefas_versao` são funções sem argumentos calculadas uma vez por versão dos dados
+        (previsões, anomalias); por serem as mais caras e compartilhadas por todos os filtros, rodam primeiro.
+        Retorna True se o aquecimento foi agendado nesta chamada.
+        """
+        with self._lock:
+            if versao_dados in self._versoes_agendadas:
+                return False
+            self._versoes_agendadas.add(versao_dados)
+
+        for tarefa_versao in tarefas_versao:
+            self._executor.submit(self._executar, tarefa_versao)
+        for assinatura in assinaturas:
+            self._executor.submit(self._executar, tarefa, assinatura)
+        return True
+
+    @staticmethod
+    def _executar(tarefa, *argumentos):
+        try:
+            tarefa(*argumentos)
+        except Exception:
+            # O aquecimento é apenas uma otimização: falhas não devem afetar o dashboard
+            logger.exception("Falha ao aquecer o cache (%s%s)", getattr(tarefa, '__name__', tarefa), argumentos)
@@ -0,0 +1,153 @@
+import io
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import quote, urlparse
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from column_mapping import column_mapping
+
+# Colunas obrigatórias em cada partição, com os nomes originais da planilha
+COLUNAS_OBRIGATORIAS = list(column_mapping.keys())
+
+TENTATIVAS_PADRAO = 3
+ESPERA_INICIAL_SEGUNDOS = 1.0
+TIMEOUT_SEGUNDOS = 60
+
+
+class ErroCarregamento(Exception):
+    """
+    Falha ao baixar, ler ou validar uma das fontes de dados.
+    """
+
+    def __init__(self, fonte, mensagem):
+        super().__init__(f"{fonte}: {mensagem}")
+        self.fonte = fonte
+
+
+def url_aba_google_sheets(sheet_id, tab_name):
+    """
+    URL de export CSV de uma aba de uma planilha pública do Google Sheets.
+    """
+    return f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={quote(tab_name)}"
+
+
+def _eh_http(fonte):
+    return urlparse(str(fonte)).scheme in ('http', 'https')
+
+
+def _criar_sessao(max_conexoes):
+    # Uma sessão compartilhada reaproveita conexões HTTP entre as partições
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=max_conexoes, pool_maxsize=max_conexoes)
+    sessao.mount('http://', adaptador)
+    sessao.mount('https://', adaptador)
+    return sessao
+
+
+def _baixar(sessao, fonte, tentativas, espera_inicial):
+    espera = espera_inicial
+    for tentativa in range(1, tentativas + 1):
+        try:
+            resposta = sessao.get(fonte, timeout=TIMEOUT_SEGUNDOS)
+            # Erros 5xx e 429 são transitórios; os demais 4xx não melhoram com novas tentativas
+            if resposta.status_code >= 500 or resposta.status_code == 429:
+                resposta.raise_for_status()
+            if resposta.status_code >= 400:
+                raise ErroCarregamento(fonte, f"HTTP {resposta.status_code}")
+            return resposta.content
+        except requests.RequestException as e:
+            if tentativa == tentativas:
+                raise ErroCarregamento(fonte, f"falha após {tentativas} tentativa(s): {e}") from e
+            time.sleep(espera)
+            espera *= 2
+
+
+def ler_fonte(fonte, sessao=None, tentativas=TENTATIVAS_PADRAO, espera_inicial=ESPERA_INICIAL_SEGUNDOS):
+    """
+    Lê uma fonte CSV (URL http/https ou caminho local) e valida as colunas obrigatórias.
+    """
+    try:
+        if _eh_http(fonte):
+            conteudo = _baixar(sessao or requests.Session(), fonte, tentativas, espera_inicial)
+            df = pd.read_csv(io.BytesIO(conteudo))
+        else:
+            caminho = urlparse(fonte).path if str(fonte).startswith('file://') else fonte
+            df = pd.read_csv(caminho)
+    except ErroCarregamento:
+        raise
+    except Exception as e:
+        raise ErroCarregamento(fonte, str(e)) from e
+
+    faltando = [c for c in COLUNAS_OBRIGATORIAS if c not in df.columns]
+    if faltando:
+        raise ErroCarregamento(fonte, f"colunas ausentes: {', '.join(faltando)}")
+    return df
+
+
+def iterar_fontes(fontes, max_workers=None, tentativas=TENTATIVAS_PADRAO, espera_inicial=ESPERA_INICIAL_SEGUNDOS):
+    """
+    Baixa e lê as fontes em paralelo, devolvendo (índice da fonte, DataFrame) à medida que ficam prontas.
+    No máximo `max_workers` partições ficam em memória ao mesmo tempo, o que permite gravar
+    cada uma em disco (modo out-of-core) sem juntar todas.
+    Levanta ErroCarregamento se qualquer fonte falhar ou se nenhuma fonte estiver configurada.
+    """
+    fontes = list(fontes)
+    if not fontes:
+        raise ErroCarregamento("configuração", "nenhuma fonte de dados configurada (sheet_tabs/data_sources)")
+
+    max_workers = max_workers or min(len(fontes), 8)
+    sessao = _criar_sessao(max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="carregamento") as executor:
+            pendentes = {}
+            proximas = iter(enumerate(fontes))
+            for indice, fonte in proximas:
+                pendentes[executor.submit(ler_fonte, fonte, sessao, tentativas, espera_inicial)] = indice
+                if len(pendentes) >= max_workers:
+                    break
+            while pendentes:
+                concluidas, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+                for futuro in concluidas:
+                    indice = pendentes.pop(futuro)
+                    yield indice, futuro.result()
+                    proxima = next(proximas, None)
+                    if proxima is not None:
+                        pendentes[executor.submit(ler_fonte, proxima[1], sessao, tentativas, espera_inicial)] = proxima[0]
+    finally:
+        sessao.close()
+
+
+def carregar_fontes(fontes, max_workers=None, tentativas=TENTATIVAS_PADRAO, espera_inicial=ESPERA_INICIAL_SEGUNDOS):
+    """
+    Baixa e lê as fontes em paralelo e concatena o resultado em um único DataFrame.
+    O tempo total fica próximo ao da partição mais lenta, e não à soma de todas.
+    Levanta ErroCarregamento se qualquer fonte falhar ou se nenhuma fonte estiver configurada.
+    """
+    particoes = dict(iterar_fontes(fontes, max_workers, tentativas, espera_inicial))
+    # Mantém a ordem em que as fontes foram configuradas
+    return pd.concat([particoes[i] for i in sorted(particoes)], ignore_index=True)
+
+
+def preprocessar_dados(df):
+    """
+    Converte tipos e renomeia as colunas para os nomes amigáveis.
+    """
+    # Convert 'mes' to datetime objects
+    df['mes'] = pd.to_datetime(df['mes'], format='%Y-%m')
+
+    # Conversão robusta de colunas numéricas (atribuição da coluna inteira, para que fiquem com dtype numérico):
+    df['faturamento'] = pd.to_numeric(df['faturamento'].astype(str).str.replace(',', '.', regex=False), errors='coerce').fillna(0)
+    df['faturamento_total_cidade_mes'] = pd.to_numeric(df['faturamento_total_cidade_mes'].astype(str).str.replace(',', '.', regex=False), errors='coerce').fillna(0)
+
+    df['unidades_fisicas'] = pd.to_numeric(df['unidades_fisicas'], errors='coerce').fillna(0)
+    df['pedidos'] = pd.to_numeric(df['pedidos'], errors='coerce').fillna(0)
+    df['total_pedidos_cidade_mes'] = pd.to_numeric(df['total_pedidos_cidade_mes'], errors='coerce').fillna(0)
+
+    # Renomear colunas para nomes amigáveis usando o mapping importado
+    df = df.rename(columns=column_mapping)
+
+    # As métricas derivadas (participações e ticket médio) são calculadas sob demanda: ver metricas.py
+    return df
@@ -0,0 +1,188 @@
+import io
+
+import pandas as pd
+import xlsxwriter
+
+from metricas import adicionar_metricas
+
+# Formatos numéricos aplicados na célula (os valores continuam numéricos na planilha).
+# O código de localidade 416 corresponde ao pt-BR.
+FORMATO_MOEDA = '[$R$-416] #,##0.00'
+FORMATO_INTEIRO = '#,##0'
+FORMATO_PERCENTUAL = '0.00"%"'
+FORMATO_DECIMAL = '#,##0.00'
+FORMATO_MES = 'yyyy-mm'
+# Linhas por aba do Excel, incluindo o cabeçalho; além disso o xlsxwriter descarta as linhas sem erro
+LINHAS_MAXIMAS_EXCEL = 1_048_576
+# Data zero dos números seriais de data do Excel
+EPOCA_EXCEL = pd.Timestamp('1899-12-30')
+
+COLUNAS_MOEDA = {
+    'Faturamento do Produto',
+    'Faturamento Total da Cidade no Mês',
+    'Ticket Médio do Produto',
+    'Faturamento Total Produtos Selecionados',
+    'Ticket Médio Geral Cidade',
+    'Previsão Faturamento Próximo Mês',
+}
+COLUNAS_INTEIRO = {
+    'Quantidade',
+    'Unidades Compradas',
+    'Pedidos com Produto',
+    'Total de Pedidos da Cidade no Mês',
+    'Unidades Compradas Produtos Selecionados',
+    'Pedidos com Produtos Selecionados',
+    'Previsão Unidades Próximo Mês',
+}
+COLUNAS_PERCENTUAL = {
+    'Participação Faturamento Cidade Mês (%)',
+    'Participação Pedidos Cidade Mês (%)',
+}
+COLUNAS_RESUMO = [
+    'Mês', 'Cidade', 'Estado',
+    'Faturamento Total Produtos Selecionados',
+    'Unidades Compradas Produtos Selecionados',
+    'Pedidos com Produtos Selecionados',
+    'Total de Pedidos da Cidade no Mês',
+    'Faturamento Total da Cidade no Mês',
+    'Participação Faturamento Cidade Mês (%)',
+    'Participação Pedidos Cidade Mês (%)',
+    'Ticket Médio Geral Cidade',
+]
+
+
+def calcular_resumo(df_filtrado):
+    """
+    Resumo executivo por Mês/Cidade/Estado, com valores numéricos (sem formatação).
+    As participações e o ticket médio são recalculados sobre os totais de cada grupo.
+    """
+    resumo = df_filtrado.groupby(['Mês', 'Cidade', 'Estado']).agg({
+        'Faturamento do Produto': 'sum',
+        'Unidades Compradas': 'sum',
+        'Pedidos com Produto': 'sum',
+        'Total de Pedidos da Cidade no Mês': 'first',
+        'Faturamento Total da Cidade no Mês': 'first',
+    }).reset_index()
+    resumo = adicionar_metricas(resumo)
+
+    return resumo.rename(columns={
+        'Faturamento do Produto': 'Faturamento Total Produtos Selecionados',
+        'Unidades Compradas': 'Unidades Compradas Produtos Selecionados',
+        'Pedidos com Produto': 'Pedidos com Produtos Selecionados',
+        'Ticket Médio do Produto': 'Ticket Médio Geral Cidade',
+    })[COLUNAS_RESUMO]
+
+
+def _formato_coluna(formatos, coluna, serie, formato_total=None):
+    if coluna == 'Mês' or pd.api.types.is_datetime64_any_dtype(serie):
+        return formatos['mes']
+    if coluna in COLUNAS_MOEDA:
+        return formatos['moeda']
+    if coluna in COLUNAS_INTEIRO:
+        return formatos['inteiro']
+    if coluna in COLUNAS_PERCENTUAL:
+        return formatos['percentual']
+    if coluna == 'Total' and formato_total is not None:
+        return formatos[formato_total]
+    if pd.api.types.is_numeric_dtype(serie):
+        return formatos['decimal']
+    return None
+
+
+def _valores_coluna(serie):
+    """
+    Converte uma coluna inteira para valores Python prontos para o xlsxwriter (None = célula vazia).
+    Datas viram números seriais do Excel; o formato da coluna as exibe como mês.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        valores = ((serie - EPOCA_EXCEL) / pd.Timedelta(days=1)).astype(object)
+    elif pd.api.types.is_bool_dtype(serie):
+        valores = serie.astype(object)
+    elif pd.api.types.is_numeric_dtype(serie):
+        valores = serie.astype(float).astype(object)
+    else:
+        valores = serie.astype(object)
+        valores = valores.where(valores.isna(), valores.astype(str))
+    return valores.where(valores.notna(), None).tolist()
+
+
+def _escrever_aba(workbook, formatos, nome_aba, dados, formato_total=None):
+    """
+    Escreve um DataFrame (ou um iterável de blocos, ex.: um por mês) em uma aba.
+    Os formatos numéricos são definidos por coluna e cada bloco é convertido coluna a coluna;
+    as linhas são escritas inteiras e em ordem, como exige o modo constant_memory.
+    Acima do limite de linhas do Excel os dados continuam em "<nome_aba> (2)", "(3)" etc.
+    """
+    blocos = [dados] if isinstance(dados, pd.DataFrame) else dados
+    colunas_formatos = None
+    worksheet = None
+    n_abas = 0
+    linha = LINHAS_MAXIMAS_EXCEL
+
+    def nova_aba():
+        sufixo = f" ({n_abas})" if n_abas > 1 else ""
+        aba = workbook.add_worksheet(nome_aba[:31 - len(sufixo)] + sufixo)
+        aba.freeze_panes(1, 0)
+        for col_idx, (coluna, formato) in enumerate(colunas_formatos):
+            # Células sem formato próprio herdam o formato da coluna
+            aba.set_column(col_idx, col_idx, max(12, min(len(str(coluna)) + 2, 45)), formato)
+            aba.write_string(0, col_idx, str(coluna), formatos['cabecalho'])
+        return aba
+
+    for bloco in blocos:
+        if colunas_formatos is None:
+            colunas_formatos = [(coluna, _formato_coluna(formatos, coluna, bloco[coluna], formato_total)) for coluna in bloco.columns]
+        for registro in zip(*(_valores_coluna(bloco[coluna]) for coluna, _ in colunas_formatos)):
+            if linha == LINHAS_MAXIMAS_EXCEL:
+                n_abas += 1
+                worksheet = nova_aba()
+                linha = 1
+            worksheet.write_row(linha, 0, registro)
+            linha += 1
+
+    if worksheet is None:
+        # Sem linhas: a aba é criada mesmo assim, só com o cabeçalho (se houver colunas)
+        colunas_formatos = colunas_formatos or []
+        n_abas += 1
+        nova_aba()
+
+
+def gerar_csv(dados, saida=None):
+    """
+    CSV dos dados filtrados, escrito bloco a bloco (um DataFrame ou um iterável de blocos).
+    Com `saida` (arquivo binário) o CSV é gravado nela; sem, os bytes são retornados.
+    """
+    output = io.BytesIO() if saida is None else saida
+    blocos = [dados] if isinstance(dados, pd.DataFrame) else dados
+    for i, bloco in enumerate(blocos):
+        output.write(bloco.to_csv(index=False, header=(i == 0)).encode('utf-8'))
+    return output.getvalue() if saida is None else None
+
+
+def gerar_excel(df_filtrado, resumo, tops, saida=None):
+    """
+    Gera o arquivo XLSX de export com as abas "Dados Filtrados", "Resumo" e uma aba por ranking.
+    `df_filtrado` pode ser um DataFrame ou um iterável de blocos (modo out-of-core).
+    `tops` é um dicionário {nome_aba: (DataFrame, formato da coluna 'Total')}.
+    O arquivo é escrito em modo constant_memory: cada linha vai para disco assim que é escrita.
+    Com `saida` (caminho ou arquivo binário) o XLSX é gravado nela; sem, os bytes são retornados.
+    """
+    output = io.BytesIO() if saida is None else saida
+    # Textos são gravados como texto: nada de fórmulas ou links criados a partir do conteúdo
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_formulas': False, 'strings_to_urls': False})
+    formatos = {
+        'cabecalho': workbook.add_format({'bold': True, 'font_color': 'white', 'bg_color': '#4e9f00'}),
+        'moeda': workbook.add_format({'num_format': FORMATO_MOEDA}),
+        'inteiro': workbook.add_format({'num_format': FORMATO_INTEIRO}),
+        'percentual': workbook.add_format({'num_format': FORMATO_PERCENTUAL}),
+        'decimal': workbook.add_format({'num_format': FORMATO_DECIMAL}),
+        'mes': workbook.add_format({'num_format': FORMATO_MES}),
+    }
+
+    _escrever_aba(workbook, formatos, 'Dados Filtrados', df_filtrado)
+    _escrever_aba(workbook, formatos, 'Resumo', resumo)
+    for nome_aba, (df_top, formato_total) in tops.items():
+        _escrever_aba(workbook, formatos, nome_aba[:31], df_top, formato_total)
+
+    workbook.close()
+    return output.getvalue() if saida is None else None
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+from agregacoes import CHAVES_SERIE, aplicar_filtros, matrizes_series
+from metricas import calcular_metrica
+
+# Meses anteriores usados como linha de base de cada mês (janela móvel)
+JANELA_BASE = 6
+# Mínimo de meses com valor diferente de zero na linha de base para avaliar um mês:
+# séries intermitentes (vendas esporádicas) não têm uma base confiável
+MESES_MINIMOS_BASE = 3
+# |z| a partir do qual uma variação é considerada anomalia
+LIMIAR_Z = 3.0
+# Piso do desvio padrão, relativo à média da linha de base: evita z enormes em séries quase constantes
+PISO_DESVIO_RELATIVO = 0.1
+# Variação mínima, em pontos percentuais, para uma mudança de participação ser reportada
+LIMIAR_PARTICIPACAO_PP = 2.0
+
+METRICA_PARTICIPACAO = 'Participação Faturamento Cidade Mês (%)'
+COLUNAS_ANOMALIAS = ['Mês'] + CHAVES_SERIE + ['Métrica', 'valor', 'base', 'variacao', 'z']
+
+
+def _linha_base(Y):
+    """
+    Média e desvio padrão dos `JANELA_BASE` meses anteriores a cada mês (sem incluir o próprio mês),
+    via somas acumuladas: o custo não depende do tamanho da janela.
+    """
+    n_series, n_meses = Y.shape
+    soma = np.zeros((n_series, n_meses + 1))
+    soma_quadrados = np.zeros((n_series, n_meses + 1))
+    nao_zeros = np.zeros((n_series, n_meses + 1))
+    np.cumsum(Y, axis=1, out=soma[:, 1:])
+    np.cumsum(Y ** 2, axis=1, out=soma_quadrados[:, 1:])
+    np.cumsum(Y != 0, axis=1, out=nao_zeros[:, 1:])
+
+    fim = np.arange(n_meses)
+    inicio = np.maximum(fim - JANELA_BASE, 0)
+    contagem = fim - inicio
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = (soma[:, fim] - soma[:, inicio]) / contagem
+        variancia = (soma_quadrados[:, fim] - soma_quadrados[:, inicio]) / contagem - media ** 2
+    desvio = np.sqrt(np.clip(variancia, 0, None))
+    invalidos = (nao_zeros[:, fim] - nao_zeros[:, inicio]) < MESES_MINIMOS_BASE
+    media[invalidos] = np.nan
+    desvio[invalidos] = np.nan
+    return media, desvio
+
+
+def _escores_z(Y):
+    media, desvio = _linha_base(Y)
+    desvio = np.maximum(desvio, PISO_DESVIO_RELATIVO * np.abs(media))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(desvio > 0, (Y - media) / desvio, 0.0)
+    return z, media
+
+
+def detectar_anomalias(dados):
+    """
+    Varre todas as séries Produto × Cidade × Mês de uma vez e devolve as anomalias de faturamento,
+    unidades e participação no faturamento da cidade, da maior para a menor |z|.
+    `dados` é o DataFrame completo ou o armazenamento mensal do modo out-of-core.
+    """
+    series, meses, matrizes = matrizes_series(dados)
+    if len(series) == 0:
+        return pd.DataFrame(columns=COLUNAS_ANOMALIAS)
+
+    # Participação recalculada sobre as somas de cada Produto × Cidade × Mês
+    matrizes[METRICA_PARTICIPACAO] = calcular_metrica(METRICA_PARTICIPACAO, matrizes)
+    del matrizes['Faturamento Total da Cidade no Mês']
+
+    chaves = series.to_frame(index=False)
+    partes = []
+    for metrica, Y in matrizes.items():
+        z, base = _escores_z(Y)
+        anomalia = np.abs(z) >= LIMIAR_Z
+        if metrica == METRICA_PARTICIPACAO:
+            anomalia &= np.abs(Y - base) >= LIMIAR_PARTICIPACAO_PP
+        linhas, colunas = np.nonzero(anomalia)
+        if len(linhas) == 0:
+            continue
+        parte = chaves.iloc[linhas].reset_index(drop=True)
+        parte.insert(0, 'Mês', meses[colunas])
+        parte['Métrica'] = metrica
+        parte['valor'] = Y[linhas, colunas]
+        parte['base'] = base[linhas, colunas]
+        parte['variacao'] = parte['valor'] - parte['base']
+        parte['z'] = z[linhas, colunas]
+        partes.append(parte)
+
+    if not partes:
+        return pd.DataFrame(columns=COLUNAS_ANOMALIAS)
+    anomalias = pd.concat(partes, ignore_index=True)
+    ordem = np.argsort(-anomalias['z'].abs().to_numpy(), kind='stable')
+    return anomalias.iloc[ordem].reset_index(drop=True)[COLUNAS_ANOMALIAS]
+
+
+def filtrar_anomalias(anomalias, assinatura, n=None):
+    """
+    Anomalias dentro dos filtros de uma assinatura de `assinatura_filtros`, mantendo a ordem por |z|.
+    """
+    filtradas = aplicar_filtros(anomalias, assinatura)
+    return filtradas if n is None else filtradas.head(n)
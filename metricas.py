@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+# Métricas derivadas: nome amigável -> (numerador, denominador, escala), sempre numerador / denominador * escala.
+# Como são razões, após agregar os dados cada métrica deve ser recalculada a partir das somas
+# do numerador e do denominador (e nunca somando ou tirando a média das razões linha a linha).
+# Exceção intencional: o KPI "% Partic. Faturamento Prod. (Méd.)" é, por definição, a média das
+# participações de cada linha (ver agregacoes._parciais_kpis).
+metricas_derivadas = {
+    "Participação Faturamento Cidade Mês (%)": ("Faturamento do Produto", "Faturamento Total da Cidade no Mês", 100),
+    "Participação Pedidos Cidade Mês (%)": ("Pedidos com Produto", "Total de Pedidos da Cidade no Mês", 100),
+    "Ticket Médio do Produto": ("Faturamento do Produto", "Pedidos com Produto", 1),
+}
+
+
+def divisao_segura(numerador, denominador, escala=1):
+    """
+    numerador / denominador * escala, com zero onde o denominador é zero. Aceita escalares, arrays e Series.
+    """
+    numerador = np.asarray(numerador, dtype=float)
+    denominador = np.asarray(denominador, dtype=float)
+    resultado = np.zeros(np.broadcast(numerador, denominador).shape)
+    np.divide(numerador * escala, denominador, out=resultado, where=denominador != 0)
+    return resultado if resultado.ndim else float(resultado)
+
+
+def calcular_metrica(nome, valores, colunas=None):
+    """
+    Calcula uma métrica do registro a partir de `valores` (DataFrame, dicionário de arrays ou de totais).
+    `colunas` mapeia o nome de uma coluna base para o nome usado em `valores`, quando diferentes.
+    """
+    numerador, denominador, escala = metricas_derivadas[nome]
+    colunas = colunas or {}
+    resultado = divisao_segura(valores[colunas.get(numerador, numerador)], valores[colunas.get(denominador, denominador)], escala)
+    if isinstance(valores, pd.DataFrame):
+        return pd.Series(resultado, index=valores.index, name=nome)
+    return resultado
+
+
+def adicionar_metricas(df, nomes=None):
+    """
+    Cópia rasa do DataFrame com as métricas derivadas pedidas (todas, por padrão) acrescentadas ao final.
+    """
+    nomes = metricas_derivadas if nomes is None else nomes
+    return df.assign(**{nome: calcular_metrica(nome, df) for nome in nomes})
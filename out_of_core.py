@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from metricas import adicionar_metricas
+
+ARQUIVO_MANIFESTO = 'manifesto.json'
+
+# Medidas gravadas sempre como float64; 'Mês' como data e as demais colunas (dimensões, SKU) como texto.
+# Cada fonte infere os próprios tipos: sem um schema fixo, as partes de um mesmo mês podem ter tipos
+# incompatíveis (ex.: SKU inteiro em uma aba e alfanumérico em outra) e não poderiam ser lidas juntas.
+COLUNAS_NUMERICAS = [
+    'Quantidade',
+    'Unidades Compradas',
+    'Pedidos com Produto',
+    'Faturamento do Produto',
+    'Total de Pedidos da Cidade no Mês',
+    'Faturamento Total da Cidade no Mês',
+]
+
+
+def _como_texto(serie):
+    # Códigos numéricos lidos como float (por causa de valores ausentes) viram '123', e não '123.0'
+    if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+        serie = serie.astype('Int64')
+    return serie.astype('string')
+
+
+def _normalizar_tipos(df):
+    """
+    DataFrame e schema Arrow com os tipos fixos usados em todas as partições.
+    """
+    colunas = {}
+    campos = []
+    for coluna in df.columns:
+        if coluna == 'Mês':
+            colunas[coluna] = pd.to_datetime(df[coluna]).astype('datetime64[ns]')
+            tipo = pa.timestamp('ns')
+        elif coluna in COLUNAS_NUMERICAS:
+            colunas[coluna] = pd.to_numeric(df[coluna], errors='coerce').astype('float64')
+            tipo = pa.float64()
+        else:
+            colunas[coluna] = _como_texto(df[coluna])
+            tipo = pa.string()
+        campos.append(pa.field(coluna, tipo))
+    return pd.DataFrame(colunas, index=df.index), pa.schema(campos)
+
+
+class ArmazenamentoMensal:
+    """
+    Dados pré-processados gravados em disco em Parquet, com um diretório por mês.
+    As consultas leem um mês por vez, já filtrado, de modo que a memória usada
+    depende do tamanho de um mês e não do histórico completo.
+    """
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        self._hashes = []
+        self.versao_dados = None
+        caminho_manifesto = os.path.join(diretorio, ARQUIVO_MANIFESTO)
+        if os.path.exists(caminho_manifesto):
+            with open(caminho_manifesto, encoding='utf-8') as f:
+                self.versao_dados = json.load(f).get('versao_dados')
+
+    def limpar(self):
+        """
+        Remove as partições e o manifesto gravados anteriormente.
+        Apenas os itens criados por esta classe (`mes=*` e o manifesto) são apagados: o restante
+        do diretório configurado é preservado.
+        """
+        os.makedirs(self.diretorio, exist_ok=True)
+        for nome in os.listdir(self.diretorio):
+            caminho = os.path.join(self.diretorio, nome)
+            if nome.startswith('mes=') and os.path.isdir(caminho):
+                shutil.rmtree(caminho)
+            elif nome == ARQUIVO_MANIFESTO:
+                os.remove(caminho)
+        self._hashes = []
+        self.versao_dados = None
+
+    def gravar(self, df):
+        """
+        Acrescenta um DataFrame já pré-processado, dividindo-o por mês, com os tipos de `_normalizar_tipos`.
+        """
+        df, esquema = _normalizar_tipos(df)
+        for mes, grupo in df.groupby(df['Mês'].dt.strftime('%Y-%m')):
+            diretorio_mes = os.path.join(self.diretorio, f"mes={mes}")
+            os.makedirs(diretorio_mes, exist_ok=True)
+            grupo.to_parquet(os.path.join(diretorio_mes, f"parte-{uuid.uuid4().hex}.parquet"), index=False, schema=esquema)
+        self._hashes.append(hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest())
+
+    def finalizar(self):
+        """
+        Conclui a carga e grava o manifesto com a versão dos dados.
+        A versão independe da ordem em que as fontes terminaram de carregar.
+        """
+        self.versao_dados = hashlib.sha1(''.join(sorted(self._hashes)).encode()).hexdigest()[:16]
+        with open(os.path.join(self.diretorio, ARQUIVO_MANIFESTO), 'w', encoding='utf-8') as f:
+            json.dump({'versao_dados': self.versao_dados, 'meses': self.meses}, f)
+
+    @property
+    def meses(self):
+        """
+        Meses disponíveis ('YYYY-MM'), em ordem crescente.
+        """
+        if not os.path.isdir(self.diretorio):
+            return []
+        return sorted(
+            nome.split('=', 1)[1] for nome in os.listdir(self.diretorio)
+            if nome.startswith('mes=') and os.path.isdir(os.path.join(self.diretorio, nome))
+        )
+
+    def _ler_mes(self, mes, colunas=None, filtro=None):
+        dataset = ds.dataset(os.path.join(self.diretorio, f"mes={mes}"), format='parquet')
+        # Fontes com colunas extras diferentes: o schema do mês é a união dos schemas das partes
+        dataset = ds.dataset(dataset.files, format='parquet', schema=pa.unify_schemas([pq.read_schema(f) for f in dataset.files]))
+        return dataset.to_table(columns=colunas, filter=filtro).to_pandas()
+
+    def iterar(self, assinatura=None, colunas=None, meses=None):
+        """
+        Devolve, mês a mês, os blocos filtrados por uma assinatura de `assinatura_filtros`.
+        `meses` (lista de 'YYYY-MM') restringe a leitura além dos meses da assinatura.
+        """
+        meses_assinatura, estados, cidades, produtos = assinatura or ((), (), (), ())
+        selecionados = self.meses
+        if meses_assinatura:
+            meses_assinatura = set(meses_assinatura)
+            selecionados = [m for m in selecionados if m in meses_assinatura]
+        if meses is not None:
+            meses = set(meses)
+            selecionados = [m for m in selecionados if m in meses]
+
+        # Filtros de estado, cidade e produto são aplicados na leitura do Parquet
+        filtro = None
+        for coluna, valores in (('Estado', estados), ('Cidade', cidades), ('Produto', produtos)):
+            if valores:
+                condicao = ds.field(coluna).isin(list(valores))
+                filtro = condicao if filtro is None else filtro & condicao
+
+        for mes in selecionados:
+            yield self._ler_mes(mes, colunas, filtro)
+
+    def opcoes_filtros(self):
+        """
+        Listas ordenadas de meses, estados, cidades e produtos e as cidades de cada estado.
+        """
+        pares = set()
+        produtos = set()
+        for bloco in self.iterar(colunas=['Estado', 'Cidade', 'Produto']):
+            pares.update(bloco[['Estado', 'Cidade']].drop_duplicates().itertuples(index=False, name=None))
+            produtos.update(bloco['Produto'].unique())
+
+        cidades_por_estado = {}
+        for estado, cidade in pares:
+            cidades_por_estado.setdefault(estado, set()).add(cidade)
+        return {
+            'meses': list(pd.to_datetime(self.meses, format='%Y-%m')),
+            'estados': sorted(cidades_por_estado),
+            'cidades': sorted({cidade for _, cidade in pares}),
+            'produtos': sorted(produtos),
+            'cidades_por_estado': {estado: sorted(cidades) for estado, cidades in cidades_por_estado.items()},
+        }
+
+    def catalogo_produtos(self):
+        """
+        Uma linha por (Produto, SKU) com o faturamento acumulado, para o índice de busca.
+        """
+        parciais = [
+            bloco.groupby(['Produto', 'SKU'], dropna=False)['Faturamento do Produto'].sum()
+            for bloco in self.iterar(colunas=['Produto', 'SKU', 'Faturamento do Produto'])
+        ]
+        if not parciais:
+            return pd.DataFrame(columns=['Produto', 'SKU', 'Faturamento do Produto'])
+        return pd.concat(parciais).groupby(level=[0, 1], dropna=False).sum().reset_index()
+
+    def maiores_linhas(self, assinatura, coluna, ascending=False, n=1000):
+        """
+        As `n` primeiras linhas ordenadas por `coluna`, mantendo apenas n linhas por vez em memória.
+        As métricas derivadas são acrescentadas a cada bloco, então também podem ser usadas na ordenação.
+        """
+        selecionadas = None
+        for bloco in self.iterar(assinatura):
+            bloco = adicionar_metricas(bloco).sort_values(coluna, ascending=ascending, kind='stable').head(n)
+            if selecionadas is not None:
+                bloco = pd.concat([selecionadas, bloco], ignore_index=True)
+            selecionadas = bloco.sort_values(coluna, ascending=ascending, kind='stable').head(n)
+        return selecionadas if selecionadas is not None else pd.DataFrame()
+
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from agregacoes import CHAVES_SERIE, matrizes_series
+
+# Modelos avaliados para cada série Produto × Cidade, na ordem dos índices devolvidos
+MODELOS = ["Sazonal ingênuo", "Tendência linear", "Suavização exponencial"]
+
+PERIODO_SAZONAL = 12
+# Meses mais recentes usados no ajuste da tendência linear
+JANELA_TENDENCIA = 6
+# Valores de alfa testados na suavização exponencial; cada série fica com o de menor erro
+ALFAS = (0.1, 0.3, 0.5, 0.7, 0.9)
+# Meses finais usados para escolher o melhor modelo de cada série (previsão um passo à frente)
+JANELA_VALIDACAO = 3
+
+COLUNA_PREVISAO_FATURAMENTO = 'Previsão Faturamento Próximo Mês'
+COLUNA_PREVISAO_UNIDADES = 'Previsão Unidades Próximo Mês'
+
+
+def _sazonal_ingenuo(Y, horizonte):
+    # Repete o valor do mesmo mês do ano anterior; sem um ano de histórico, repete o último mês
+    n_meses = Y.shape[1]
+    if n_meses >= PERIODO_SAZONAL:
+        return Y[:, n_meses - PERIODO_SAZONAL + np.arange(horizonte) % PERIODO_SAZONAL]
+    return np.repeat(Y[:, -1:], horizonte, axis=1)
+
+
+def _tendencia_linear(Y, horizonte):
+    # Mínimos quadrados em forma fechada, calculados para todas as séries de uma vez
+    janela = Y[:, -JANELA_TENDENCIA:]
+    x = np.arange(janela.shape[1], dtype=float)
+    x_centrado = x - x.mean()
+    denominador = (x_centrado ** 2).sum()
+    if denominador > 0:
+        inclinacao = janela @ x_centrado / denominador
+    else:
+        inclinacao = np.zeros(len(Y))
+    intercepto = janela.mean(axis=1) - inclinacao * x.mean()
+    passos = x[-1] + np.arange(1, horizonte + 1)
+    return np.clip(intercepto[:, None] + inclinacao[:, None] * passos, 0, None)
+
+
+def _suavizacao_exponencial(Y, horizonte):
+    # Percorre os meses uma vez, atualizando o nível de todas as séries e de todos os alfas juntos
+    alfas = np.asarray(ALFAS)
+    nivel = np.repeat(Y[:, :1], len(alfas), axis=1)
+    erro_quadratico = np.zeros_like(nivel)
+    for j in range(1, Y.shape[1]):
+        erro = Y[:, j:j + 1] - nivel
+        erro_quadratico += erro ** 2
+        nivel = nivel + alfas * erro
+    melhor_alfa = erro_quadratico.argmin(axis=1)
+    return np.repeat(nivel[np.arange(len(Y)), melhor_alfa][:, None], horizonte, axis=1)
+
+
+_FUNCOES_MODELOS = (_sazonal_ingenuo, _tendencia_linear, _suavizacao_exponencial)
+
+
+def prever_series(Y, horizonte=1):
+    """
+    Previsão para cada linha da matriz `Y` (séries × meses, em ordem cronológica).
+    Cada série usa o modelo com menor erro absoluto médio nas previsões um passo à frente
+    dos últimos `JANELA_VALIDACAO` meses.
+    Retorna (previsões com formato séries × horizonte, índice do modelo escolhido em `MODELOS`).
+    """
+    Y = np.asarray(Y, dtype=float)
+    n_series, n_meses = Y.shape
+
+    origens = [n_meses - k for k in range(1, JANELA_VALIDACAO + 1) if n_meses - k >= 2]
+    if origens:
+        erros = np.zeros((n_series, len(_FUNCOES_MODELOS)))
+        for origem in origens:
+            for m, modelo in enumerate(_FUNCOES_MODELOS):
+                erros[:, m] += np.abs(modelo(Y[:, :origem], 1)[:, 0] - Y[:, origem])
+        escolhido = erros.argmin(axis=1)
+    else:
+        # Histórico curto demais para validar: usa a suavização exponencial
+        escolhido = np.full(n_series, MODELOS.index("Suavização exponencial"))
+
+    previsoes = np.stack([modelo(Y, horizonte) for modelo in _FUNCOES_MODELOS], axis=1)
+    return previsoes[np.arange(n_series), escolhido], escolhido
+
+
+def calcular_previsoes(dados, horizonte=1):
+    """
+    Previsão de faturamento e unidades para os próximos `horizonte` meses de todas as séries
+    Produto × Cidade, ajustadas de uma só vez sobre matrizes densas.
+    `dados` é o DataFrame completo ou o armazenamento mensal do modo out-of-core.
+    Retorna uma linha por série e mês previsto.
+    """
+    series, meses, matrizes = matrizes_series(dados)
+    colunas = ['Mês'] + CHAVES_SERIE + ['faturamento', 'unidades_compradas', 'modelo_faturamento', 'modelo_unidades']
+    if len(series) == 0:
+        return pd.DataFrame(columns=colunas)
+    faturamento = matrizes['Faturamento do Produto']
+    unidades = matrizes['Unidades Compradas']
+
+    faturamento_previsto, modelo_faturamento = prever_series(faturamento, horizonte)
+    unidades_previstas, modelo_unidades = prever_series(unidades, horizonte)
+
+    meses_previstos = pd.date_range(meses[-1] + pd.DateOffset(months=1), periods=horizonte, freq='MS')
+    nomes_modelos = np.asarray(MODELOS)
+    previsoes = series.to_frame(index=False).loc[np.repeat(np.arange(len(series)), horizonte)].reset_index(drop=True)
+    previsoes.insert(0, 'Mês', np.tile(meses_previstos, len(series)))
+    previsoes['faturamento'] = faturamento_previsto.ravel()
+    previsoes['unidades_compradas'] = unidades_previstas.ravel()
+    previsoes['modelo_faturamento'] = np.repeat(nomes_modelos[modelo_faturamento], horizonte)
+    previsoes['modelo_unidades'] = np.repeat(nomes_modelos[modelo_unidades], horizonte)
+    return previsoes[colunas]
+
+
+def previsao_produtos(previsoes, assinatura):
+    """
+    Previsões somadas por Mês e Produto para os estados, cidades e produtos da assinatura,
+    no mesmo formato de `evolucao_produtos`.
+    """
+    _, estados, cidades, produtos = assinatura
+    mask = pd.Series(True, index=previsoes.index)
+    if estados:
+        mask &= previsoes['Estado'].isin(estados)
+    if cidades:
+        mask &= previsoes['Cidade'].isin(cidades)
+    if produtos:
+        mask &= previsoes['Produto'].isin(produtos)
+    return previsoes[mask].groupby(['Mês', 'Produto'], as_index=False)[['faturamento', 'unidades_compradas']].sum()
+
+
+def anexar_previsao(blocos, previsoes):
+    """
+    Acrescenta a cada linha dos blocos exportados a previsão do próximo mês da sua série Produto × Cidade.
+    """
+    proximo_mes = previsoes[previsoes['Mês'] == previsoes['Mês'].min()]
+    tabela = proximo_mes[CHAVES_SERIE + ['faturamento', 'unidades_compradas']].rename(columns={
+        'faturamento': COLUNA_PREVISAO_FATURAMENTO,
+        'unidades_compradas': COLUNA_PREVISAO_UNIDADES,
+    })
+    for bloco in blocos:
+        yield bloco.merge(tabela, on=CHAVES_SERIE, how='left')
@@ -0,0 +1,238 @@
+import numpy as np
+import pandas as pd
+
+# Precisão padrão do HyperLogLog: 2^8 = 256 registros por grupo (erro padrão ~6,5%)
+HLL_PRECISAO_PADRAO = 8
+# Itens mantidos por partição (Mês, Estado) nos resumos de itens mais frequentes
+TOPK_CAPACIDADE_PADRAO = 100
+
+# Métricas com resumo Top-K por dimensão (sem produtos selecionados)
+METRICAS_SKETCH = {
+    'Produto': ["Faturamento do Produto", "Unidades Compradas"],
+    'Cidade': ["Faturamento Total da Cidade no Mês", "Unidades Compradas", "Pedidos com Produto"],
+}
+
+
+def _hash_64(valores):
+    return pd.util.hash_array(np.asarray(valores, dtype=object))
+
+
+def _bit_length(x):
+    """
+    Número de bits significativos de cada elemento de um array uint64 (vetorizado).
+    """
+    x = x.copy()
+    n = np.zeros(x.shape, dtype=np.int64)
+    for deslocamento in (32, 16, 8, 4, 2, 1):
+        maior = x >= (np.uint64(1) << np.uint64(deslocamento))
+        n += deslocamento * maior
+        x = np.where(maior, x >> np.uint64(deslocamento), x)
+    return n + (x > 0)
+
+
+def hll_registros(grupos, hashes, n_grupos, p=HLL_PRECISAO_PADRAO):
+    """
+    Constrói, de uma só vez, os registros HyperLogLog de vários grupos.
+    `grupos` indica o grupo de cada elemento e `hashes` o hash de 64 bits do valor contado.
+    Retorna uma matriz uint8 de formato (n_grupos, 2^p).
+    """
+    m = 1 << p
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    indice = (hashes >> np.uint64(64 - p)).astype(np.int64)
+    resto = hashes << np.uint64(p)
+    rho = np.where(resto == 0, 64 - p + 1, 64 - _bit_length(resto) + 1).astype(np.uint8)
+
+    registros = np.zeros((n_grupos, m), dtype=np.uint8)
+    np.maximum.at(registros, (np.asarray(grupos, dtype=np.int64), indice), rho)
+    return registros
+
+
+def hll_estimar(registros):
+    """
+    Estimativa de cardinalidade para cada linha de uma matriz de registros HyperLogLog.
+    """
+    m = registros.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    z = np.power(2.0, -registros.astype(np.float64)).sum(axis=-1)
+    estimativa = alpha * m * m / z
+
+    # Correção para cardinalidades pequenas (linear counting)
+    zeros = (registros == 0).sum(axis=-1)
+    pequenas = (estimativa <= 2.5 * m) & (zeros > 0)
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where(pequenas, linear, estimativa)
+
+
+def hll_erro_padrao(p=HLL_PRECISAO_PADRAO):
+    return 1.04 / np.sqrt(1 << p)
+
+
+class ResumoTopK:
+    """
+    Resumo mergeável dos itens mais pesados de uma métrica, no estilo Space-Saving.
+    Para cada partição (Mês, Estado) guarda os k itens de maior peso e o "piso",
+    o maior peso descartado. Somando partições, o valor real de cada item fica entre
+    a estimativa e a estimativa mais a soma dos pisos das partições consultadas.
+    """
+
+    def __init__(self, mes, estado, chave, peso, pisos, n_chaves):
+        self.mes = mes
+        self.estado = estado
+        self.chave = chave
+        self.peso = peso
+        self.pisos = pisos
+        self.n_chaves = n_chaves
+
+    @classmethod
+    def construir(cls, base, coluna_chave, coluna_peso, n_meses, n_estados, n_chaves, k=TOPK_CAPACIDADE_PADRAO):
+        """
+        `base` contém uma linha por (mes, estado, chave) com códigos inteiros e o peso agregado.
+        """
+        base = base.sort_values(['mes', 'estado', coluna_peso], ascending=[True, True, False])
+        posicao = base.groupby(['mes', 'estado'], sort=False).cumcount().to_numpy()
+
+        mantidos = base[posicao < k]
+        descartados = base[posicao == k]
+
+        pisos = np.zeros((n_meses, n_estados), dtype=np.float64)
+        pisos[descartados['mes'].to_numpy(), descartados['estado'].to_numpy()] = descartados[coluna_peso].to_numpy(dtype=np.float64)
+
+        return cls(
+            mantidos['mes'].to_numpy(dtype=np.int32),
+            mantidos['estado'].to_numpy(dtype=np.int32),
+            mantidos[coluna_chave].to_numpy(dtype=np.int64),
+            mantidos[coluna_peso].to_numpy(dtype=np.float64),
+            pisos,
+            n_chaves,
+        )
+
+    def consultar(self, meses_sel, estados_sel):
+        """
+        Soma as partições selecionadas (máscaras booleanas de meses e estados).
+        Retorna (estimativa por chave, erro máximo por item).
+        """
+        mask = meses_sel[self.mes] & estados_sel[self.estado]
+        totais = np.bincount(self.chave[mask], weights=self.peso[mask], minlength=self.n_chaves)
+        erro = self.pisos[np.ix_(meses_sel, estados_sel)].sum()
+        return totais, erro
+
+
+class SketchesMensais:
+    """
+    Sketches mantidos por mês no momento da carga: HyperLogLog de cidades distintas por
+    produto e por estado, e resumos Top-K de produtos e cidades por partição (Mês, Estado).
+    Também guarda as listas de opções dos filtros, já ordenadas.
+    """
+
+    def __init__(self, df, p=HLL_PRECISAO_PADRAO, k=TOPK_CAPACIDADE_PADRAO):
+        self.p = p
+        self.k = k
+
+        meses = df['Mês'].dt.to_period('M').dt.to_timestamp()
+        mes_cat = pd.Categorical(meses)
+        estado_cat = pd.Categorical(df['Estado'])
+        cidade_cat = pd.Categorical(df['Cidade'])
+        produto_cat = pd.Categorical(df['Produto'])
+
+        self.meses = list(mes_cat.categories)
+        self.estados = list(estado_cat.categories)
+        self.cidades = list(cidade_cat.categories)
+        self.produtos = list(produto_cat.categories)
+        self.cidades_por_estado = {
+            estado: sorted(grupo.unique())
+            for estado, grupo in df.groupby('Estado', observed=True)['Cidade']
+        }
+
+        n_meses, n_estados = len(self.meses), len(self.estados)
+        codigos = pd.DataFrame({
+            'mes': mes_cat.codes.astype(np.int32),
+            'estado': estado_cat.codes.astype(np.int32),
+            'cidade': cidade_cat.codes.astype(np.int32),
+            'produto': produto_cat.codes.astype(np.int32),
+        })
+        # Linhas com valores ausentes nas dimensões não entram nos sketches
+        validos = (codigos >= 0).all(axis=1).to_numpy()
+        codigos = codigos[validos]
+        df = df[validos]
+
+        # HyperLogLog de cidades distintas, com uma matriz de registros por mês
+        hash_cidade = _hash_64(self.cidades)[codigos['cidade'].to_numpy()]
+        self.hll_produto = hll_registros(
+            codigos['mes'].to_numpy(np.int64) * len(self.produtos) + codigos['produto'].to_numpy(),
+            hash_cidade, n_meses * len(self.produtos), p
+        ).reshape(n_meses, len(self.produtos), -1)
+        self.hll_estado = hll_registros(
+            codigos['mes'].to_numpy(np.int64) * n_estados + codigos['estado'].to_numpy(),
+            hash_cidade, n_meses * n_estados, p
+        ).reshape(n_meses, n_estados, -1)
+
+        # Resumos Top-K por (dimensão, métrica)
+        self.topk = {}
+        for metrica in METRICAS_SKETCH['Produto']:
+            base = codigos[['mes', 'estado', 'produto']].assign(peso=df[metrica].to_numpy(dtype=np.float64))
+            base = base.groupby(['mes', 'estado', 'produto'], as_index=False)['peso'].sum()
+            self.topk[('Produto', metrica)] = ResumoTopK.construir(base, 'produto', 'peso', n_meses, n_estados, len(self.produtos), k)
+        for metrica in METRICAS_SKETCH['Cidade']:
+            base = codigos[['mes', 'estado', 'cidade']].assign(peso=df[metrica].to_numpy(dtype=np.float64))
+            agregacao = 'first' if metrica == "Faturamento Total da Cidade no Mês" else 'sum'
+            base = base.groupby(['mes', 'estado', 'cidade'], as_index=False)['peso'].agg(agregacao)
+            self.topk[('Cidade', metrica)] = ResumoTopK.construir(base, 'cidade', 'peso', n_meses, n_estados, len(self.cidades), k)
+
+    def _mascaras(self, meses, estados):
+        """
+        Máscaras booleanas das partições selecionadas; listas vazias significam "todos".
+        """
+        meses_str = set(meses)
+        meses_sel = np.array([not meses_str or m.strftime('%Y-%m') in meses_str for m in self.meses], dtype=bool)
+        estados_set = set(estados)
+        estados_sel = np.array([not estados_set or e in estados_set for e in self.estados], dtype=bool)
+        return meses_sel, estados_sel
+
+    def top(self, dimensao, metrica, meses=(), estados=(), n=10):
+        """
+        Top N aproximado de uma dimensão. Retorna (DataFrame [dimensao, 'Total'], erro máximo por item).
+        O valor real de cada item está entre 'Total' e 'Total' + erro.
+        """
+        meses_sel, estados_sel = self._mascaras(meses, estados)
+        totais, erro = self.topk[(dimensao, metrica)].consultar(meses_sel, estados_sel)
+
+        n = min(n, int((totais > 0).sum()))
+        indices = np.argpartition(-totais, n - 1)[:n] if n > 0 else np.array([], dtype=np.int64)
+        indices = indices[np.argsort(-totais[indices], kind='stable')]
+
+        nomes = self.produtos if dimensao == 'Produto' else self.cidades
+        top = pd.DataFrame({dimensao: [nomes[i] for i in indices], 'Total': totais[indices]})
+        return top, erro
+
+    def cidades_distintas_por_produto(self, meses=()):
+        """
+        Estimativa HyperLogLog de cidades distintas por produto nos meses selecionados (todos os estados).
+        """
+        meses_sel, _ = self._mascaras(meses, ())
+        registros = self.hll_produto[meses_sel].max(axis=0) if meses_sel.any() else np.zeros_like(self.hll_produto[0])
+        return pd.Series(hll_estimar(registros), index=self.produtos)
+
+    def cidades_distintas_por_estado(self, meses=()):
+        """
+        Estimativa HyperLogLog de cidades distintas por estado nos meses selecionados.
+        """
+        meses_sel, _ = self._mascaras(meses, ())
+        registros = self.hll_estado[meses_sel].max(axis=0) if meses_sel.any() else np.zeros_like(self.hll_estado[0])
+        return pd.Series(hll_estimar(registros), index=self.estados)
+
+    def opcoes_filtros(self):
+        """
+        Listas ordenadas de meses, estados, cidades e produtos e as cidades de cada estado.
+        """
+        return {
+            'meses': self.meses,
+            'estados': self.estados,
+            'cidades': self.cidades,
+            'produtos': self.produtos,
+            'cidades_por_estado': self.cidades_por_estado,
+        }
+
+    @property
+    def erro_padrao_hll(self):
+        return hll_erro_padrao(self.p)
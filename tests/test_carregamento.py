@@ -0,0 +1,134 @@
+"""
+Testes do carregamento paralelo contra um servidor HTTP local e arquivos locais.
+Execute com: python -m pytest -q
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+from carregamento import COLUNAS_OBRIGATORIAS, ErroCarregamento, carregar_fontes, ler_fonte
+
+ESPERA_TESTE = 0.01
+
+
+def _csv(cidade):
+    linha = {coluna: 0 for coluna in COLUNAS_OBRIGATORIAS}
+    linha.update({'mes': '2024-01', 'cidade': cidade, 'estado': 'SP', 'nome_universal': 'Copo', 'sku': 'C1'})
+    return pd.DataFrame([linha]).to_csv(index=False).encode('utf-8')
+
+
+class _Servidor:
+    """
+    Servidor HTTP local. Rotas:
+    /ok/<cidade>, /lento/<segundos>/<cidade>, /instavel/<falhas>/<cidade> (503 nas primeiras <falhas> requisições),
+    /ausente (404) e /sem-colunas (CSV com schema errado).
+    """
+
+    def __init__(self):
+        self.requisicoes = {}
+        self._lock = threading.Lock()
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with servidor._lock:
+                    servidor.requisicoes[self.path] = servidor.requisicoes.get(self.path, 0) + 1
+                    contagem = servidor.requisicoes[self.path]
+                partes = self.path.strip('/').split('/')
+                status, corpo = 200, None
+                if partes[0] == 'ok':
+                    corpo = _csv(partes[1])
+                elif partes[0] == 'lento':
+                    time.sleep(float(partes[1]))
+                    corpo = _csv(partes[2])
+                elif partes[0] == 'instavel':
+                    if contagem <= int(partes[1]):
+                        status, corpo = 503, b'indisponivel'
+                    else:
+                        corpo = _csv(partes[2])
+                elif partes[0] == 'sem-colunas':
+                    corpo = b'a,b\n1,2\n'
+                else:
+                    status, corpo = 404, b'nao encontrado'
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def fechar(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def servidor():
+    srv = _Servidor()
+    yield srv
+    srv.fechar()
+
+
+def test_repete_erros_transitorios_ate_conseguir(servidor):
+    df = ler_fonte(f"{servidor.url}/instavel/2/Campinas", tentativas=3, espera_inicial=ESPERA_TESTE)
+    assert df['cidade'].tolist() == ['Campinas']
+    assert servidor.requisicoes['/instavel/2/Campinas'] == 3
+
+
+def test_desiste_apos_esgotar_as_tentativas(servidor):
+    with pytest.raises(ErroCarregamento, match="3 tentativa"):
+        ler_fonte(f"{servidor.url}/instavel/5/Campinas", tentativas=3, espera_inicial=ESPERA_TESTE)
+    assert servidor.requisicoes['/instavel/5/Campinas'] == 3
+
+
+def test_espera_cresce_exponencialmente(servidor, monkeypatch):
+    esperas = []
+    monkeypatch.setattr('carregamento.time.sleep', esperas.append)
+    ler_fonte(f"{servidor.url}/instavel/3/Campinas", tentativas=4, espera_inicial=0.5)
+    assert esperas == [0.5, 1.0, 2.0]
+
+
+def test_erro_4xx_nao_e_repetido(servidor):
+    with pytest.raises(ErroCarregamento, match="HTTP 404"):
+        ler_fonte(f"{servidor.url}/ausente", tentativas=3, espera_inicial=ESPERA_TESTE)
+    assert servidor.requisicoes['/ausente'] == 1
+
+
+def test_valida_colunas_obrigatorias(servidor):
+    with pytest.raises(ErroCarregamento, match="colunas ausentes"):
+        ler_fonte(f"{servidor.url}/sem-colunas")
+
+
+def test_mantem_a_ordem_das_fontes_e_baixa_em_paralelo(servidor):
+    fontes = [f"{servidor.url}/lento/0.5/Primeira", f"{servidor.url}/ok/Segunda", f"{servidor.url}/lento/0.5/Terceira"]
+    inicio = time.perf_counter()
+    df = carregar_fontes(fontes, max_workers=3)
+    assert time.perf_counter() - inicio < 0.9
+    assert df['cidade'].tolist() == ['Primeira', 'Segunda', 'Terceira']
+
+
+def test_mistura_arquivos_locais_e_http(servidor, tmp_path):
+    arquivo = tmp_path / 'local.csv'
+    arquivo.write_bytes(_csv('Local'))
+    df = carregar_fontes([str(arquivo), f"{servidor.url}/ok/Remota", f"file://{arquivo}"])
+    assert df['cidade'].tolist() == ['Local', 'Remota', 'Local']
+
+
+def test_falha_de_uma_fonte_interrompe_a_carga(servidor):
+    with pytest.raises(ErroCarregamento) as erro:
+        carregar_fontes([f"{servidor.url}/ok/Campinas", f"{servidor.url}/ausente"], espera_inicial=ESPERA_TESTE)
+    assert erro.value.fonte.endswith('/ausente')
+
+
+def test_sem_fontes_configuradas():
+    with pytest.raises(ErroCarregamento, match="nenhuma fonte"):
+        carregar_fontes([])
@@ -0,0 +1,43 @@
+"""
+Testes do export XLSX.
+Execute com: python -m pytest -q
+"""
+import io
+import re
+import zipfile
+
+import pandas as pd
+
+import export_excel
+from export_excel import gerar_excel
+
+
+def _abas(conteudo):
+    # Nome de cada aba e o número de linhas gravadas nela (cabeçalho incluído)
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as arquivo:
+        nomes = re.findall(r'<sheet name="([^"]+)"', arquivo.read('xl/workbook.xml').decode('utf-8'))
+        return {
+            nome: arquivo.read(f'xl/worksheets/sheet{i}.xml').decode('utf-8').count('<row ')
+            for i, nome in enumerate(nomes, start=1)
+        }
+
+
+def test_dados_acima_do_limite_continuam_em_novas_abas(monkeypatch):
+    monkeypatch.setattr(export_excel, 'LINHAS_MAXIMAS_EXCEL', 4)
+    blocos = [pd.DataFrame({'Produto': [f'P{i}' for i in range(inicio, inicio + 5)]}) for inicio in (0, 5)]
+
+    abas = _abas(gerar_excel(blocos, pd.DataFrame({'Cidade': ['Campinas']}), {}))
+
+    # 10 linhas de dados, no máximo 3 por aba além do cabeçalho
+    assert abas == {
+        'Dados Filtrados': 4,
+        'Dados Filtrados (2)': 4,
+        'Dados Filtrados (3)': 4,
+        'Dados Filtrados (4)': 2,
+        'Resumo': 2,
+    }
+
+
+def test_dados_vazios_mantem_o_cabecalho():
+    abas = _abas(gerar_excel(pd.DataFrame(columns=['Produto']), pd.DataFrame(columns=['Cidade']), {}))
+    assert abas == {'Dados Filtrados': 1, 'Resumo': 1}
@@ -0,0 +1,123 @@
+"""
+Testes do armazenamento mensal em Parquet (modo out-of-core).
+Execute com: python -m pytest -q
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from agregacoes import aplicar_filtros, assinatura_filtros, blocos_filtrados, calcular_agregados, totais_periodo
+from export_excel import calcular_resumo
+from out_of_core import ArmazenamentoMensal
+
+ASSINATURAS = [
+    assinatura_filtros(),
+    assinatura_filtros(estados=['RJ']),
+    assinatura_filtros(meses=['2024-02', '2024-04']),
+    assinatura_filtros(cidades=['Cidade 3', 'Cidade 7']),
+    assinatura_filtros(estados=['SP', 'MG'], produtos=['Produto 1', 'Produto 4', 'Produto 9']),
+]
+
+
+def _linha(mes, **valores):
+    linha = {
+        'Mês': pd.Timestamp(mes), 'Cidade': 'Campinas', 'Estado': 'SP', 'Produto': 'Copo', 'SKU': 'C1',
+        'Quantidade': 1, 'Unidades Compradas': 2, 'Pedidos com Produto': 1, 'Faturamento do Produto': 10.0,
+        'Total de Pedidos da Cidade no Mês': 5, 'Faturamento Total da Cidade no Mês': 100.0,
+    }
+    linha.update(valores)
+    return linha
+
+
+def _armazenar(diretorio, *partes):
+    armazenamento = ArmazenamentoMensal(str(diretorio))
+    armazenamento.limpar()
+    for parte in partes:
+        armazenamento.gravar(parte)
+    armazenamento.finalizar()
+    return armazenamento
+
+
+def test_fontes_com_tipos_diferentes_no_mesmo_mes(tmp_path):
+    # SKU numérico em uma fonte e alfanumérico na outra; Quantidade inteira e fracionária; coluna extra só na segunda
+    primeira = pd.DataFrame([_linha('2024-01-01', SKU=123, Quantidade=1)])
+    segunda = pd.DataFrame([_linha('2024-01-01', SKU='AB-1', Quantidade=1.5, Observacao='x')])
+    armazenamento = _armazenar(tmp_path, primeira, segunda)
+
+    bloco = pd.concat(list(armazenamento.iterar()), ignore_index=True)
+    assert sorted(bloco['SKU']) == ['123', 'AB-1']
+    assert sorted(bloco['Quantidade']) == [1.0, 1.5]
+    assert calcular_agregados(armazenamento, assinatura_filtros(produtos=['Copo']))['kpis']['total_faturamento'] == 20.0
+
+
+def _fontes(n_fontes=3, n_meses=5, n_cidades=12, n_produtos=15, seed=0):
+    """
+    Partes de uma mesma base, como se viessem de abas diferentes: cada fonte traz algumas
+    cidades de todos os meses, de modo que cada mês é gravado em várias partes.
+    Valores contínuos evitam empates nos rankings.
+    """
+    rng = np.random.default_rng(seed)
+    estados = ['SP', 'RJ', 'MG']
+    linhas = []
+    for mes in pd.date_range('2024-01-01', periods=n_meses, freq='MS'):
+        for cidade in range(n_cidades):
+            pedidos_cidade = float(rng.uniform(100, 500))
+            faturamento_cidade = float(rng.uniform(10_000, 50_000))
+            for produto in rng.choice(n_produtos, size=6, replace=False):
+                linhas.append(_linha(
+                    mes, Cidade=f'Cidade {cidade}', Estado=estados[cidade % len(estados)],
+                    Produto=f'Produto {produto}', SKU=f'S{produto}', Quantidade=float(rng.uniform(0, 30)),
+                    **{
+                        'Unidades Compradas': float(rng.uniform(0, 60)),
+                        'Pedidos com Produto': float(rng.uniform(0, 30)),
+                        'Faturamento do Produto': float(rng.uniform(0, 2_000)),
+                        'Total de Pedidos da Cidade no Mês': pedidos_cidade,
+                        'Faturamento Total da Cidade no Mês': faturamento_cidade,
+                    }
+                ))
+    df = pd.DataFrame(linhas)
+    fonte = df['Cidade'].str.split().str[1].astype(int) % n_fontes
+    return [df[fonte == i].reset_index(drop=True) for i in range(n_fontes)]
+
+
+@pytest.fixture(scope='module')
+def bases(tmp_path_factory):
+    fontes = _fontes()
+    armazenamento = _armazenar(tmp_path_factory.mktemp('armazenamento'), *fontes)
+    return pd.concat(fontes, ignore_index=True), armazenamento
+
+
+@pytest.mark.parametrize('assinatura', ASSINATURAS)
+def test_agregados_iguais_aos_da_memoria(bases, assinatura):
+    df, armazenamento = bases
+    em_memoria = calcular_agregados(df, assinatura)
+    out_of_core = calcular_agregados(armazenamento, assinatura)
+
+    assert out_of_core['vazio'] is em_memoria['vazio'] is False
+    assert out_of_core['kpis'] == pytest.approx(em_memoria['kpis'])
+    assert out_of_core['tops'].keys() == em_memoria['tops'].keys()
+    for chave, top in em_memoria['tops'].items():
+        pd.testing.assert_frame_equal(out_of_core['tops'][chave], top, check_dtype=False)
+
+
+@pytest.mark.parametrize('assinatura', ASSINATURAS)
+def test_totais_periodo_iguais_aos_da_memoria(bases, assinatura):
+    df, armazenamento = bases
+    com_produtos = bool(assinatura[3])
+    faturamento, pedidos, meses = totais_periodo(blocos_filtrados(armazenamento, assinatura), com_produtos)
+    esperado = totais_periodo(blocos_filtrados(df, assinatura), com_produtos)
+    assert (faturamento, pedidos) == pytest.approx(esperado[:2])
+    assert meses == esperado[2]
+
+
+@pytest.mark.parametrize('assinatura', ASSINATURAS)
+def test_resumo_igual_ao_da_memoria(bases, assinatura):
+    df, armazenamento = bases
+    chaves = ['Mês', 'Cidade', 'Estado']
+    out_of_core = pd.concat([calcular_resumo(bloco) for bloco in armazenamento.iterar(assinatura)], ignore_index=True)
+    esperado = calcular_resumo(aplicar_filtros(df, assinatura))
+    pd.testing.assert_frame_equal(
+        out_of_core.sort_values(chaves, ignore_index=True),
+        esperado.sort_values(chaves, ignore_index=True),
+        check_dtype=False,
+    )
@@ -0,0 +1,104 @@
+"""
+Testes dos sketches do modo aproximado (HyperLogLog e resumos Top-K).
+Execute com: python -m pytest -q
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from sketches import SketchesMensais, _bit_length, _hash_64, hll_erro_padrao, hll_estimar, hll_registros
+
+# Estimativas do HyperLogLog aceitas a até 3 erros padrão do valor exato
+DESVIOS_ACEITOS = 3
+
+
+def _dados(n_meses=4, n_estados=3, n_cidades=600, n_produtos=40, seed=0):
+    rng = np.random.default_rng(seed)
+    meses = pd.date_range('2024-01-01', periods=n_meses, freq='MS')
+    linhas = []
+    for mes in meses:
+        for cidade in range(n_cidades):
+            estado = f'E{cidade % n_estados}'
+            faturamento_cidade = float(rng.uniform(1_000, 5_000))
+            for produto in rng.choice(n_produtos, size=3, replace=False):
+                # Pesos bem diferentes entre produtos, para que o Top-K descarte itens em cada partição
+                peso = float(rng.pareto(1.5) * (produto + 1))
+                linhas.append({
+                    'Mês': mes, 'Estado': estado, 'Cidade': f'C{cidade}', 'Produto': f'P{produto}',
+                    'Faturamento do Produto': peso * 10, 'Unidades Compradas': float(rng.integers(0, 50)),
+                    'Pedidos com Produto': float(rng.integers(0, 20)),
+                    'Faturamento Total da Cidade no Mês': faturamento_cidade,
+                })
+    return pd.DataFrame(linhas)
+
+
+def test_bit_length_igual_ao_do_python():
+    rng = np.random.default_rng(0)
+    valores = np.concatenate([
+        np.array([0, 1, 2, 3, 255, 256, 2 ** 32 - 1, 2 ** 32, 2 ** 63, 2 ** 64 - 1], dtype=np.uint64),
+        rng.integers(0, 2 ** 63, size=1_000, dtype=np.uint64) << rng.integers(0, 2, size=1_000).astype(np.uint64),
+    ])
+    assert _bit_length(valores).tolist() == [int(v).bit_length() for v in valores.tolist()]
+
+
+@pytest.mark.parametrize('cardinalidade', [10, 300, 5_000, 50_000])
+def test_hll_dentro_do_erro_padrao(cardinalidade):
+    valores = [f'cidade-{i}' for i in range(cardinalidade)]
+    # Cada valor aparece mais de uma vez: repetições não podem alterar a estimativa
+    hashes = _hash_64(valores + valores[::2])
+    estimativa = hll_estimar(hll_registros(np.zeros(len(hashes), dtype=np.int64), hashes, 1))[0]
+    assert abs(estimativa - cardinalidade) <= DESVIOS_ACEITOS * hll_erro_padrao() * cardinalidade
+
+
+def test_cidades_distintas_proximas_do_nunique():
+    df = _dados()
+    sketches = SketchesMensais(df)
+    erro_padrao = sketches.erro_padrao_hll
+    for meses in ((), ('2024-02', '2024-03')):
+        filtrado = df[df['Mês'].dt.strftime('%Y-%m').isin(meses)] if meses else df
+        for dimensao, estimativas in (
+            ('Estado', sketches.cidades_distintas_por_estado(meses)),
+            ('Produto', sketches.cidades_distintas_por_produto(meses)),
+        ):
+            exatas = filtrado.groupby(dimensao)['Cidade'].nunique()
+            assert np.all(np.abs(estimativas[exatas.index] - exatas) <= DESVIOS_ACEITOS * erro_padrao * exatas)
+
+
+@pytest.mark.parametrize('dimensao, metrica', [
+    ('Produto', 'Faturamento do Produto'),
+    ('Produto', 'Unidades Compradas'),
+    ('Cidade', 'Pedidos com Produto'),
+    ('Cidade', 'Faturamento Total da Cidade no Mês'),
+])
+@pytest.mark.parametrize('meses, estados', [((), ()), (('2024-01', '2024-04'), ('E1',))])
+def test_topk_contem_o_total_exato(dimensao, metrica, meses, estados):
+    df = _dados()
+    # k menor que o catálogo: cada partição (Mês, Estado) descarta itens
+    sketches = SketchesMensais(df, k=5)
+    top, erro = sketches.top(dimensao, metrica, meses=meses, estados=estados, n=10)
+    assert erro > 0
+
+    filtrado = df
+    if meses:
+        filtrado = filtrado[filtrado['Mês'].dt.strftime('%Y-%m').isin(meses)]
+    if estados:
+        filtrado = filtrado[filtrado['Estado'].isin(estados)]
+    if metrica == 'Faturamento Total da Cidade no Mês':
+        exatos = filtrado.groupby(['Mês', 'Cidade'])[metrica].first().groupby('Cidade').sum()
+    else:
+        exatos = filtrado.groupby(dimensao)[metrica].sum()
+
+    exatos_top = exatos[top[dimensao]].to_numpy()
+    tolerancia = 1e-6 * exatos.max()
+    assert np.all(exatos_top >= top['Total'].to_numpy() - tolerancia)
+    assert np.all(exatos_top <= top['Total'].to_numpy() + erro + tolerancia)
+
+
+def test_topk_exato_quando_k_cobre_o_catalogo():
+    df = _dados(n_cidades=60)
+    sketches = SketchesMensais(df, k=1_000)
+    top, erro = sketches.top('Produto', 'Faturamento do Produto', n=5)
+    exatos = df.groupby('Produto')['Faturamento do Produto'].sum().nlargest(5)
+    assert erro == 0
+    assert top['Produto'].tolist() == exatos.index.tolist()
+    assert np.allclose(top['Total'], exatos.to_numpy())